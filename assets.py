@@ -0,0 +1,168 @@
+import os
+import json
+import mmap
+import struct
+
+import pygame
+
+from config import *
+from logs import *
+from assetstore import ASSETS
+
+''' A surface plus where its top left sits relative to the original image.
+
+    The surface is only built the first time it's drawn, and is held in the
+    shared asset store until the sprite is released.
+'''
+class Sprite():
+    def __init__(self, key, load, offset=(0, 0)):
+        self.key = key
+        self.load = load
+        self.offset = offset
+        self.loaded = None
+
+    @property
+    def surface(self):
+        if self.loaded is None:
+            self.loaded = ASSETS.acquire(self.key, self.load)
+
+        return self.loaded
+
+    def release(self):
+        if self.loaded is not None:
+            self.loaded = None
+            ASSETS.release(self.key)
+
+''' Loads sprites ready to blit.
+
+    Each image is cropped to the bounding box of its visible pixels and
+    converted to the display's pixel format, optionally with premultiplied
+    alpha.  The cropped pixels are packed into one binary atlas file on disk
+    so later startups skip PNG decoding and cropping.  The atlas is rebuilt
+    whenever a source image changes.  It's memory mapped, so sprites that are
+    never drawn are never read.
+'''
+class SpriteLoader():
+    MAGIC = b"MCAT1"
+
+    def __init__(self, cache_path=None, crop=True, premultiply=False):
+        self.log = Logger("assets")
+        self.cache_path = cache_path
+        self.crop = crop
+        self.premultiply = premultiply and hasattr(pygame.Surface, "premul_alpha")
+        self.atlas = None
+
+        if premultiply and not self.premultiply:
+            self.log.warning("This pygame can't premultiply alpha, using straight alpha")
+
+    ## Blit flags that go with the sprites this loader makes
+    def blit_flags(self):
+        return self.premultiply and pygame.BLEND_PREMULTIPLIED or 0
+
+    def signature(self, paths):
+        files = []
+        for path in paths:
+            stat = os.stat(path)
+            files.append([path, stat.st_size, stat.st_mtime_ns])
+
+        return { "crop": self.crop, "files": files }
+
+    def load(self, paths):
+        signature = self.signature(paths)
+        raw = self.read_atlas(signature)
+
+        if raw is None:
+            raw = { path: self.decode(path) for path in paths }
+            self.write_atlas(signature, raw)
+
+        return { path: self.make_sprite(path, *raw[path]) for path in paths }
+
+    def make_sprite(self, path, data, size, offset):
+        return Sprite(f"sprite:{path}", lambda: self.prepare(data, size), tuple(offset))
+
+    ## Decode and crop one image.  Returns RGBA bytes, size and offset.
+    def decode(self, path):
+        surface = pygame.image.load(path)
+        rect = surface.get_bounding_rect() if self.crop else surface.get_rect()
+
+        if rect.width == 0 or rect.height == 0:
+            rect = surface.get_rect()
+
+        cropped = surface.subsurface(rect).copy()
+        return (self.tobytes(cropped, "RGBA"), rect.size, rect.topleft)
+
+    @staticmethod
+    def tobytes(surface, format):
+        # tostring was renamed tobytes in pygame 2.1.3
+        tobytes = getattr(pygame.image, "tobytes", None) or pygame.image.tostring
+        return tobytes(surface, format)
+
+    def prepare(self, data, size):
+        surface = pygame.image.frombuffer(data, size, "RGBA").convert_alpha()
+
+        if self.premultiply:
+            surface = surface.premul_alpha()
+
+        return surface
+
+    ## Atlas layout: magic, header length, JSON header, then every image's
+    ## RGBA bytes back to back
+    def read_atlas(self, signature):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return None
+
+        try:
+            with open(self.cache_path, "rb") as fil:
+                if fil.read(len(self.MAGIC)) != self.MAGIC:
+                    return None
+
+                (header_size,) = struct.unpack("<I", fil.read(4))
+                header = json.loads(fil.read(header_size).decode("utf-8"))
+
+                if header['signature'] != signature:
+                    self.log.info("Sprite atlas is out of date, rebuilding")
+                    return None
+
+                self.atlas = mmap.mmap(fil.fileno(), 0, access=mmap.ACCESS_READ)
+
+            data = memoryview(self.atlas)[len(self.MAGIC) + 4 + header_size:]
+
+            raw = {}
+            for path, entry in header['sprites'].items():
+                start, length = entry['start'], entry['length']
+                raw[path] = (data[start:start + length], tuple(entry['size']), tuple(entry['offset']))
+
+            self.log.info(f"Loaded {len(raw)} sprites from {self.cache_path}")
+            return raw
+
+        except Exception as e:
+            self.log.warning(f"Failed to read sprite atlas {self.cache_path}: {e}")
+            return None
+
+    def write_atlas(self, signature, raw):
+        if not self.cache_path:
+            return
+
+        sprites = {}
+        start = 0
+        for path, (data, size, offset) in raw.items():
+            sprites[path] = { "start": start, "length": len(data), "size": list(size), "offset": list(offset) }
+            start += len(data)
+
+        header = json.dumps({ "signature": signature, "sprites": sprites }).encode("utf-8")
+
+        try:
+            os.makedirs(os.path.dirname(self.cache_path) or ".", exist_ok=True)
+
+            tmp_path = f"{self.cache_path}.tmp"
+            with open(tmp_path, "wb") as fil:
+                fil.write(self.MAGIC)
+                fil.write(struct.pack("<I", len(header)))
+                fil.write(header)
+                for (data, _, _) in raw.values():
+                    fil.write(data)
+            os.replace(tmp_path, self.cache_path)
+
+            self.log.info(f"Wrote {len(raw)} sprites to {self.cache_path}")
+        except Exception as e:
+            self.log.warning(f"Failed to write sprite atlas {self.cache_path}: {e}")
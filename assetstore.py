@@ -0,0 +1,86 @@
+from collections import OrderedDict
+from threading import RLock
+
+from config import *
+from logs import *
+
+''' Shared store for loaded assets (surfaces, file contents).
+
+    Assets are loaded the first time someone acquires them and reference
+    counted after that.  Once nothing references an asset it stays around in
+    an idle pool, oldest dropped first, until the pool goes over idle_bytes.
+'''
+class AssetStore():
+    def __init__(self, idle_bytes):
+        self.log = Logger("assets")
+        self.idle_bytes = idle_bytes
+        self.entries = OrderedDict()
+        self.lock = RLock()
+
+    def size_of(self, value):
+        if isinstance(value, (bytes, bytearray, str)):
+            return len(value)
+
+        if hasattr(value, "get_bytesize"):
+            return value.get_width() * value.get_height() * value.get_bytesize()
+
+        return 0
+
+    def acquire(self, key, load):
+        with self.lock:
+            entry = self.entries.get(key)
+
+            if entry is None:
+                value = load()
+                entry = { "value": value, "refs": 0, "bytes": self.size_of(value) }
+                self.entries[key] = entry
+                self.log.debug(f"Loaded {key} ({entry['bytes']} bytes)")
+
+            entry['refs'] += 1
+            self.entries.move_to_end(key)
+
+            return entry['value']
+
+    def release(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+
+            if entry is None:
+                return
+
+            entry['refs'] = max(0, entry['refs'] - 1)
+            self.trim()
+
+    ## Load (or reuse) an asset without holding a reference to it
+    def get(self, key, load):
+        with self.lock:
+            value = self.acquire(key, load)
+            self.release(key)
+
+            return value
+
+    def trim(self):
+        idle = [key for key, entry in self.entries.items() if entry['refs'] == 0]
+        idle_bytes = sum(self.entries[key]['bytes'] for key in idle)
+
+        for key in idle:
+            if idle_bytes <= self.idle_bytes:
+                break
+
+            idle_bytes -= self.entries.pop(key)['bytes']
+
+    def memory_usage(self, detail=False):
+        with self.lock:
+            usage = {
+                "entries": len(self.entries),
+                "bytes": sum(entry['bytes'] for entry in self.entries.values()),
+                "referenced_bytes": sum(entry['bytes'] for entry in self.entries.values() if entry['refs']),
+            }
+
+            if detail:
+                usage['assets'] = { key: { "refs": entry['refs'], "bytes": entry['bytes'] }
+                                    for key, entry in self.entries.items() }
+
+            return usage
+
+ASSETS = AssetStore(CONFIG.getint("assets", "idle_cache_mb", fallback=32) * 1024 * 1024)
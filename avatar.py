@@ -1,7 +1,11 @@
+import io
+import os
+import sys
 import time
 import json
 import re
-from random import random
+from concurrent.futures import Future
+from random import random, randint
 from threading import Thread
 
 import azure.cognitiveservices.speech as speechsdk
@@ -11,11 +15,19 @@ from pygame.locals import *
 from config import *
 from logs import *
 from obs import ObsApp
+from posecache import PoseCache, quantize
+from assets import SpriteLoader
+from assetstore import ASSETS
+from framebuffer import FrameBuffer
+from visemes import VisemeTimeline
+from synthesis import PreSynthesizer, Utterance
+from speechcache import SpeechCache
+from speechqueue import SpeechQueue, PRIORITIES
+from tracing import TRACER
 
 class AvatarApp():
     #thread = None
     running = False
-    queue = []
     last_completion = None
     is_talking = False
     future = None
@@ -26,13 +38,47 @@ class AvatarApp():
     is_ack = False
     angle = 0.0
     scale = 1.0
-
-    def __init__(self):
+    frame_call = None
+    tick_pending = False
+    base_frame = None
+    base_pose = None
+    frame_buffer = None
+    presynth = None
+    channel = None
+    speaking_priority = None
+    speaking_trace = None
+    interrupt = False
+    sound = None
+
+    def __init__(self, scheduler=None):
         self.log = Logger(f"avatar")
-        self.images = []
+        self.scheduler = scheduler
+        self.queue = SpeechQueue.from_config("speech")
+        self.queue.on_drop = self.on_speech_dropped
         self.mouths = []
         self.eyes = []
         self.body = None
+        self.feature_rects = []
+
+        self.frame_rate = CONFIG.getint("avatar", "frame_rate", fallback=60)
+
+        ## window draws to a pygame window for OBS to capture.  headless has no
+        ## window and publishes frames to a memory mapped ring buffer instead.
+        self.render_mode = CONFIG.get("avatar", "render_mode", fallback="window")
+        self.frame_buffer_path = CONFIG.get("avatar", "frame_buffer_path", fallback="avatar/.cache/frames.bin")
+        self.frame_buffer_slots = CONFIG.getint("avatar", "frame_buffer_slots", fallback=3)
+
+        self.idle_interval = CONFIG.getfloat("avatar", "idle_interval", fallback=0.25)
+
+        ## Head wobble poses are snapped to these steps so rendered poses can be
+        ## cached and reused
+        self.pose_angle_step = CONFIG.getfloat("avatar", "pose_angle_step", fallback=2.0)
+        self.pose_scale_step = CONFIG.getfloat("avatar", "pose_scale_step", fallback=0.05)
+        self.pose_cache = PoseCache(CONFIG.getint("avatar", "pose_cache_mb", fallback=256) * 1024 * 1024)
+
+        ## Visemes are shown when the audio reaches them, shifted by this many
+        ## seconds to make up for output latency
+        self.timeline = VisemeTimeline(CONFIG.getfloat("avatar", "viseme_sync_offset", fallback=0.0))
 
         self.voice = CONFIG.get("avatar", "voice", fallback="en-US-AvaMultilingualNeural")
         self.width = CONFIG.getint("avatar", "width", fallback=900)
@@ -40,6 +86,26 @@ class AvatarApp():
         self.speech_key = SECRETS.get("avatar", "speech_key", fallback=None)
         self.speech_region = CONFIG.get("avatar", "speech_region", fallback="eastus")
 
+        ## stream speaks each line through the speech SDK once the last one is
+        ## done.  pipelined synthesizes lines as they're queued and plays them
+        ## back to back.
+        self.synthesis_mode = CONFIG.get("avatar", "synthesis_mode", fallback="stream")
+
+        ## Lines that have been spoken before are played from disk.  Only stock
+        ## lines (bang responses, command confirmations) are cached unless
+        ## speech_cache_replies is on, since free-form replies rarely repeat.
+        speech_cache_path = CONFIG.get("avatar", "speech_cache_path", fallback=None)
+        self.speech_cache_replies = CONFIG.getboolean("avatar", "speech_cache_replies", fallback=False)
+        if speech_cache_path:
+            self.speech_cache = SpeechCache(speech_cache_path,
+                                            CONFIG.getint("avatar", "speech_cache_mb", fallback=64) * 1024 * 1024)
+        else:
+            self.speech_cache = None
+
+        self.spoken_text = None
+        self.spoken_visemes = []
+        self.spoken_cache = False
+
         self.enable_title_updates = CONFIG.getboolean("avatar", "enable_title_updates", fallback=False)
         self.enable_obs_updates = CONFIG.getboolean("avatar", "enable_obs_updates", fallback=False)
         self.source_name = CONFIG.get("avatar", "obs_source_name", fallback=None)
@@ -64,8 +130,8 @@ class AvatarApp():
         self.emoji_map = json.loads(CONFIG.get("avatar", "emoji_emotion_map", fallback="{}"))
         self.emotion_map = json.loads(CONFIG.get("avatar", "emotion_eye_map", fallback="{}"))
 
-        self.init_images()
         self.init_pygame()
+        self.init_images()
         self.init_obs()
         self.init_corrections()
 
@@ -76,19 +142,59 @@ class AvatarApp():
         self.init_tts()
         self.blit_viseme()
         self.update_obs()
+        self.wake()
 
     def shutdown(self):
         if self.enable_obs_updates:
             self.obs.shutdown()
 
+        if self.presynth:
+            self.presynth.shutdown()
+
+        if self.channel:
+            self.channel.stop()
+
         self.running = False
+        self.pose_cache.clear()
+        self.release_images()
+
+        if self.frame_buffer:
+            self.frame_buffer.close()
+            self.frame_buffer = None
+
         pygame.display.quit()
 
-    def say(self, text):
+    def say(self, text, priority=PRIORITIES['discussion'], trace=None, stock=False):
         self.log.info(f"Appending {text}")
         self.is_ack = False
 
-        self.queue.append(text)
+        self.queue.put({ "text": text, "priority": priority, "trace": trace,
+                         "cache": stock or self.speech_cache_replies })
+
+        if self.is_talking and self.speaking_priority is not None:
+            self.interrupt = self.interrupt or self.queue.preempts(priority, self.speaking_priority)
+
+        self.wake()
+
+    ## Find or start synthesizing the speech for everything in the queue.
+    ## Done from tick rather than say so it all happens on the main thread.
+    def prepare_speech(self):
+        for entry in self.queue.snapshot():
+            if 'speech' not in entry:
+                self.prepare_entry(entry)
+
+    def prepare_entry(self, entry):
+        spoken = self.clean_text(entry['text'])
+        cached = self.speech_cache and self.speech_cache.get(self.voice, spoken)
+
+        if cached:
+            entry['speech'] = Future()
+            entry['speech'].set_result(cached)
+        elif self.presynth:
+            entry['speech'] = self.presynth.submit(spoken)
+            entry['speech'].add_done_callback(lambda f: self.on_synthesized(f, entry.get('cache')))
+        else:
+            entry['speech'] = None
 
     def ack(self):
         if self.is_ack:
@@ -104,24 +210,85 @@ class AvatarApp():
         self.update_title()
         self.is_talking = False
         self.ack_sound.play()
+        self.wake()
 
+    ## Needs the display set up first so sprites can be converted to its format
     def init_images(self):
-        for i in range(0,22):
-            self.images.append(pygame.image.load(f"avatar/bobby-id-{i}.png"))
-            self.mouths.append(pygame.image.load(f"avatar/mouth-id-{i}.png"))
-        
-        for i in range(0,10):
-            self.eyes.append(pygame.image.load(f"avatar/eye-id-{i}.png"))
+        loader = SpriteLoader(
+            cache_path=CONFIG.get("avatar", "asset_cache_path", fallback=None),
+            crop=CONFIG.getboolean("avatar", "crop_assets", fallback=True),
+            premultiply=CONFIG.getboolean("avatar", "premultiply_assets", fallback=False)
+        )
+        self.blit_flags = loader.blit_flags()
+
+        mouth_paths = [f"avatar/mouth-id-{i}.png" for i in range(0,22)]
+        eye_paths = [f"avatar/eye-id-{i}.png" for i in range(0,10)]
+        body_path = "avatar/bobby-body.png"
 
-        self.body = pygame.image.load("avatar/bobby-body.png")
+        sprites = loader.load(mouth_paths + eye_paths + [body_path])
+        self.mouths = [sprites[path] for path in mouth_paths]
+        self.eyes = [sprites[path] for path in eye_paths]
+        self.body = sprites[body_path]
+
+    def release_images(self):
+        for sprite in self.mouths + self.eyes + [self.body]:
+            sprite.release()
     
     def init_pygame(self):
-        self.screen = pygame.display.set_mode((self.width, self.height))
-        pygame.display.set_caption("metachat")
+        if self.render_mode == "headless":
+            # SDL's dummy driver gives us a display surface without a window
+            # or a display server
+            os.environ["SDL_VIDEODRIVER"] = "dummy"
+            self.screen = pygame.display.set_mode((self.width, self.height), 0, 32)
+            self.init_frame_buffer()
+        else:
+            self.screen = pygame.display.set_mode((self.width, self.height))
+            pygame.display.set_caption("metachat")
+
         self.clock = pygame.time.Clock()
         pygame.mixer.init()
         self.ack_sound = pygame.mixer.Sound("avatar/ack.wav")
-        self.temp_surface = pygame.Surface((self.width, self.height), pygame.SRCALPHA)
+        self.center = (self.width // 2, self.height // 2)
+
+    ## Publish the screen's pixels as they are if they're in a layout readers
+    ## know, otherwise convert each frame to BGRA
+    def init_frame_buffer(self):
+        masks = self.screen.get_masks()
+        formats = {
+            (0xff0000, 0xff00, 0xff): "BGR",
+            (0xff, 0xff00, 0xff0000): "RGB"
+        }
+        pixel_format = formats.get(tuple(masks[:3]))
+
+        if pixel_format and self.screen.get_bytesize() == 4:
+            self.frame_convert = False
+            pixel_format += masks[3] and "A" or "X"
+            stride = self.screen.get_pitch()
+        else:
+            self.frame_convert = True
+            pixel_format = "BGRA"
+            stride = self.width * 4
+
+        self.frame_buffer = FrameBuffer(self.frame_buffer_path, self.width, self.height, stride,
+                                        pixel_format, self.frame_buffer_slots)
+
+    def publish_frame(self):
+        if not self.frame_buffer:
+            return
+
+        if self.frame_convert:
+            self.frame_buffer.publish(SpriteLoader.tobytes(self.screen, "BGRA"))
+        else:
+            self.frame_buffer.publish(self.screen.get_buffer())
+
+    ## Push the frame out, either the whole thing or just the rects that changed
+    def present(self, rects=None):
+        if self.frame_buffer:
+            self.publish_frame()
+        elif rects is None:
+            pygame.display.flip()
+        else:
+            pygame.display.update(rects)
 
     def init_obs(self):
         if self.enable_obs_updates:
@@ -146,84 +313,192 @@ class AvatarApp():
         pygame.display.quit()
 
     def update_title(self):
-        if self.enable_title_updates:
+        # There's no window to title when headless
+        if self.enable_title_updates and self.render_mode != "headless":
             if self.is_talking:
                 pygame.display.set_caption("metachat talking")
             else:
                 pygame.display.set_caption("metachat")
     
+    ## Audio has started coming out, so start the playback clock
+    def on_synthesizing(self, evt):
+        self.timeline.start()
+
+        if self.speaking_trace:
+            TRACER.mark(self.speaking_trace, "speech.start")
+            self.speaking_trace = None
+
+    ## audio_offset is in 100ns ticks
     def on_viseme(self, evt):
-        self.viseme_id = evt.viseme_id
+        self.timeline.add(evt.audio_offset / 10000000, evt.viseme_id)
+        self.spoken_visemes.append((evt.audio_offset / 10000000, evt.viseme_id))
+        self.wake()
+
+    ## Don't synthesize lines that won't be said
+    def on_speech_dropped(self, entry):
+        if entry.get('speech'):
+            entry['speech'].cancel()
+
+    def on_synthesized(self, future, cache=False):
+        if cache and self.speech_cache and not future.cancelled() and not future.exception():
+            utterance = future.result()
+            self.speech_cache.put(self.voice, utterance.text, utterance)
+
+        self.wake()
+
+    def process_visemes(self):
+        viseme_id = self.timeline.due()
+        if viseme_id is None:
+            return
+
+        self.viseme_id = viseme_id
 
         if self.viseme_id == 0:
-            self.angle = random() * 20 - 10
-            self.scale = 1.0 + (random() * 0.5 - 0.25)
+            self.angle = quantize(random() * 20 - 10, self.pose_angle_step)
+            self.scale = quantize(1.0 + (random() * 0.5 - 0.25), self.pose_scale_step)
 
         self.viseme_changed = True
 
     def on_completed(self, evt):
+        self.finish_talking()
+        result = self.future.get()
+
+        if self.spoken_cache and self.speech_cache and result.reason == speechsdk.ResultReason.SynthesizingAudioCompleted:
+            self.speech_cache.put(self.voice, self.spoken_text,
+                                  Utterance(self.spoken_text, result.audio_data, self.spoken_visemes))
+
+        self.wake()
+
+    def finish_talking(self):
         self.log.info("TTS complete")
+        self.speaking_priority = None
         self.last_completion = time.time()
         self.is_talking = False
         self.scale = 1.0
         self.angle = 0.0
         self.update_obs()
         self.update_title()
-        self.future.get()
+        self.log.debug(f"Pose cache {self.pose_cache.stats()}, assets {ASSETS.memory_usage()}")
+        self.log.debug(f"Lip sync {self.timeline.stats()}")
 
-    def blit_viseme(self):
-        #self.screen.blit(self.images[self.viseme_id],(0,0))
+        if self.speech_cache:
+            self.log.debug(f"Speech cache {self.speech_cache.stats()}")
 
-        # Set background color
-        self.screen.fill(pygame.Color('#'+self.background_color))
+    ## Draw the background and the body at the current head angle/scale.  The
+    ## mouth and eyes are drawn over this and it's used to erase them again.
+    def render_base(self, pose):
+        self.base_frame = self.pose_cache.get(("base",) + pose, lambda: self.build_base(pose))
+        self.base_pose = pose
 
-        # Clear the temp_surface with transparent pixels
-        self.temp_surface.fill((0,0,0,0))
-        
-        # Draw the body
-        self.temp_surface.blit(self.body,(0,0))
+    def build_base(self, pose):
+        base_frame = pygame.Surface((self.width, self.height))
+        base_frame.fill(pygame.Color('#'+self.background_color))
 
-        # Draw the mouth
-        self.temp_surface.blit(self.mouths[self.viseme_id],self.mouth_position)
+        surface, rect = self.place_sprite(self.body, (0,0), pose)
+        base_frame.blit(surface, rect, special_flags=self.blit_flags)
 
-        # Draw the eyes
-        self.temp_surface.blit(self.eyes[self.left_eye_id],self.left_eye_position)
-        self.temp_surface.blit(self.eyes[self.right_eye_id],self.right_eye_position)
+        return base_frame
 
-        # Rotate and scale
-        rotated = pygame.transform.rotozoom(self.temp_surface, self.angle, self.scale)
-        rotated_rect = rotated.get_rect(center=(512, 512))
+    ## Work out how a sprite that sits at position on the untransformed avatar
+    ## looks and where it goes once the head is rotated and scaled about the
+    ## center of the frame.  Transformed sprites are cached when given a key.
+    def place_sprite(self, sprite, position, pose, key=None):
+        angle, scale = pose
+        rect = sprite.surface.get_rect(topleft=(position[0] + sprite.offset[0],
+                                                position[1] + sprite.offset[1]))
 
-        # Update the display
-        self.screen.blit(rotated,rotated_rect)
-        pygame.display.flip()
+        if angle == 0 and scale == 1:
+            return sprite.surface, rect
+
+        offset = pygame.math.Vector2(rect.centerx - self.center[0], rect.centery - self.center[1])
+        offset = offset.rotate(-angle) * scale
+
+        build = lambda: pygame.transform.rotozoom(sprite.surface, angle, scale)
+        transformed = self.pose_cache.get(key + pose, build) if key else build()
+
+        return transformed, transformed.get_rect(center=(self.center[0] + offset.x,
+                                                         self.center[1] + offset.y))
+
+    def blit_feature(self, sprite, position, key):
+        surface, rect = self.place_sprite(sprite, position, self.base_pose, key)
+        return self.screen.blit(surface, rect, special_flags=self.blit_flags)
+
+    def blit_features(self):
+        return [
+            self.blit_feature(self.mouths[self.viseme_id], self.mouth_position, ("mouth", self.viseme_id)),
+            self.blit_feature(self.eyes[self.left_eye_id], self.left_eye_position, ("eye", self.left_eye_id)),
+            self.blit_feature(self.eyes[self.right_eye_id], self.right_eye_position, ("eye", self.right_eye_id))
+        ]
+
+    ## Only the mouth and eyes change between most frames, so unless the head
+    ## moved just erase them from the base frame, redraw them and push those
+    ## rects to the display.
+    def blit_viseme(self):
+        pose = (self.angle, self.scale)
+
+        if pose != self.base_pose:
+            self.render_base(pose)
+            self.screen.blit(self.base_frame, (0,0))
+            self.feature_rects = self.blit_features()
+            self.present()
+            return
+
+        dirty = self.feature_rects
+        for rect in dirty:
+            self.screen.blit(self.base_frame, rect, rect)
+
+        self.feature_rects = self.blit_features()
+        self.present(dirty + self.feature_rects)
 
     def init_tts(self):
+        if self.synthesis_mode == "pipelined":
+            self.presynth = PreSynthesizer(self.speech_key, self.speech_region, self.voice)
+            return
+
         speech_config = speechsdk.SpeechConfig(subscription=self.speech_key,
                                                region=self.speech_region)
         audio_config = speechsdk.audio.AudioOutputConfig(use_default_speaker=True)
         speech_config.speech_synthesis_voice_name = self.voice
 
+        # Same WAV format as pipelined synthesis so results can be cached
+        if self.speech_cache:
+            speech_config.set_speech_synthesis_output_format(
+                speechsdk.SpeechSynthesisOutputFormat.Riff24Khz16BitMonoPcm)
+
         self.tts = speechsdk.SpeechSynthesizer(speech_config=speech_config, 
                                                audio_config=audio_config)
+        self.tts.synthesizing.connect(self.on_synthesizing)
         self.tts.viseme_received.connect(self.on_viseme)
         self.tts.synthesis_completed.connect(self.on_completed)
+        self.tts.synthesis_canceled.connect(self.on_completed)
+
+    ## Strip out the first emoji we know and return the emotion it stands for
+    def find_emotion(self, text):
+        for emoji,emotion in self.emoji_map.items():
+            if emoji in text:
+                return re.sub(emoji, "", text), emotion
+
+        return text, None
 
     def process_emoji(self, text):
         self.left_eye_id = 0
         self.right_eye_id = 0
         
-        for emoji,emotion in self.emoji_map.items():
-            if emoji in text:
-                text = re.sub(emoji, "", text)
-                self.log.debug(f"Emoji {emoji} found, setting emotion to {emotion}.")
-                self.left_eye_id = self.emotion_map[emotion]['left']
-                self.right_eye_id = self.emotion_map[emotion]['right']
-                self.viseme_changed = True
-                break
+        text, emotion = self.find_emotion(text)
+
+        if emotion:
+            self.log.debug(f"Emoji found, setting emotion to {emotion}.")
+            self.left_eye_id = self.emotion_map[emotion]['left']
+            self.right_eye_id = self.emotion_map[emotion]['right']
+            self.viseme_changed = True
 
         return text
 
+    ## The text that actually gets spoken
+    def clean_text(self, text):
+        text, _ = self.find_emotion(text)
+        return self.apply_corrections(text)
+
     def process_ack(self):
         if self.is_ack:
             self.left_eye_id -= 1
@@ -237,16 +512,87 @@ class AvatarApp():
             self.viseme_changed = True
 
     def process_tts(self):
-        if len(self.queue)>0 and not self.is_talking:                
+        entry = self.queue.peek()
+
+        if entry and not self.is_talking:                
+            # Queued by say() since prepare_speech ran this tick
+            if 'speech' not in entry:
+                self.prepare_entry(entry)
+
+            # Pipelined lines wait here until they're synthesized
+            if entry['speech'] and not entry['speech'].done():
+                return
+
+            # Dropped from the queue since we looked
+            if not self.queue.discard(entry):
+                return
+
             self.log.info("Starting TTS")
-            msg = self.queue.pop(0)
-            msg = self.process_emoji(msg)
+            self.speaking_priority = entry['priority']
+            self.speaking_trace = entry.get('trace')
+            msg = self.process_emoji(entry['text'])
             msg = self.apply_corrections(msg)
             self.log.info(f"Saying {msg}")
             self.is_talking = True
             self.update_obs()
             self.update_title()
-            self.future = self.tts.speak_text_async(msg)
+            self.timeline.reset()
+            self.spoken_text = msg
+            self.spoken_visemes = []
+            self.spoken_cache = entry.get('cache')
+
+            if entry['speech']:
+                self.play_utterance(entry['speech'])
+            else:
+                self.future = self.tts.speak_text_async(msg)
+
+    ## Play a pre-synthesized line and line up its visemes with the audio
+    def play_utterance(self, future):
+        try:
+            utterance = future.result()
+            if not utterance.audio:
+                raise Exception("No audio was synthesized")
+
+            self.sound = pygame.mixer.Sound(io.BytesIO(utterance.audio))
+            self.channel = self.sound.play()
+            if not self.channel:
+                raise Exception("No free mixer channel")
+        except Exception as e:
+            self.log.error(f"Failed to play synthesized speech: {e}")
+            self.finish_talking()
+            return
+
+        TRACER.mark(self.speaking_trace, "speech.start")
+        self.speaking_trace = None
+
+        self.timeline.start()
+        for (offset, viseme_id) in utterance.visemes:
+            self.timeline.add(offset, viseme_id)
+
+    ## Cut off the line being spoken for a more urgent one.  Finishing up is
+    ## left to the usual completion handling.
+    def process_interrupt(self):
+        if not self.interrupt:
+            return
+
+        self.interrupt = False
+        if not self.is_talking:
+            return
+
+        self.log.info("Cutting off the current line for something more important")
+        self.timeline.reset()
+
+        if self.channel:
+            self.channel.stop()
+        elif self.future:
+            self.tts.stop_speaking_async()
+
+    ## Pipelined lines are played by the mixer, so poll it to see when they end
+    def process_playback(self):
+        if self.channel and not self.channel.get_busy():
+            self.channel = None
+            self.sound = None
+            self.finish_talking()
 
     def update_viseme(self):
         if self.viseme_changed:
@@ -259,19 +605,52 @@ class AvatarApp():
             self.toggle_obs(self.is_talking)
 
     def toggle_obs(self, toggle_to=True):
-        uuid = self.obs.get_current_scene_uuid()
-        item_id = self.obs.get_scene_item_by_name(uuid, self.source_name)
-        self.obs.set_scene_item_enabled(uuid, item_id, toggle_to)
+        self.obs.set_source_enabled(self.source_name, toggle_to)
+
+    ## Ask the scheduler to run a frame as soon as possible.  Called from the
+    ## chatbot and speech SDK threads whenever something changes.  Wakes
+    ## before that frame runs share it, so a burst of events is one tick.
+    def wake(self):
+        if self.scheduler and not self.tick_pending:
+            self.tick_pending = True
+            self.scheduler.call_soon(self.tick)
+
+    ## Only animate at the full frame rate while something is moving, otherwise
+    ## just keep the window's event queue pumped.
+    def schedule_next_frame(self):
+        if self.frame_call:
+            self.frame_call.cancel()
+
+        if self.is_talking or self.is_ack or len(self.queue) > 0:
+            delay = 1.0 / self.frame_rate
+        else:
+            delay = self.idle_interval
+
+        # Wake up right when the next viseme is due rather than up to a frame late
+        due = self.timeline.next_due()
+        if due is not None:
+            delay = min(delay, due)
+
+        self.frame_call = self.scheduler.call_later(delay, self.tick)
 
     def tick(self):
+        self.tick_pending = False
+
         if self.running:
             pygame.event.pump()
 
             self.process_ack()
+            self.process_interrupt()
+            self.process_playback()
+            self.prepare_speech()
             self.process_tts()
-                
+            self.process_visemes()
+
             self.update_viseme()
 
+            if self.scheduler:
+                self.schedule_next_frame()
+
 
     def loop(self, stop_after=None):
         start_time = time.time()
@@ -284,7 +663,54 @@ class AvatarApp():
 
             self.clock.tick(60)
 
-if __name__ == "__main__":
+## Time full-frame compositing (how blit_viseme used to work) against the
+## incremental renderer.  Run with: python avatar.py --benchmark
+def run_benchmark(frames=600):
+    CONFIG.set("avatar", "enable_obs_updates", "False")
+    avatar = AvatarApp()
+
+    def blit_full_frame():
+        temp_surface = pygame.Surface((avatar.width, avatar.height), pygame.SRCALPHA)
+        avatar.screen.fill(pygame.Color('#'+avatar.background_color))
+        for (sprite, position) in [(avatar.body, (0,0)),
+                                   (avatar.mouths[avatar.viseme_id], avatar.mouth_position),
+                                   (avatar.eyes[avatar.left_eye_id], avatar.left_eye_position),
+                                   (avatar.eyes[avatar.right_eye_id], avatar.right_eye_position)]:
+            temp_surface.blit(sprite.surface, (position[0] + sprite.offset[0], position[1] + sprite.offset[1]))
+        rotated = pygame.transform.rotozoom(temp_surface, avatar.angle, avatar.scale)
+        avatar.screen.blit(rotated,rotated.get_rect(center=avatar.center))
+        pygame.display.flip()
+
+    # Same viseme sequence for both, with a head move every 10 frames
+    sequence = [(randint(0, 21), i % 10 == 0,
+                 quantize(random() * 20 - 10, avatar.pose_angle_step),
+                 quantize(1.0 + (random() * 0.5 - 0.25), avatar.pose_scale_step))
+                for i in range(frames)]
+
+    for (name, render) in [("full frame", blit_full_frame), ("incremental", avatar.blit_viseme)]:
+        avatar.base_pose = None
+        avatar.angle, avatar.scale = 0.0, 1.0
+        times = []
+
+        for (viseme_id, moved, angle, scale) in sequence:
+            avatar.viseme_id = viseme_id
+            if moved:
+                avatar.angle, avatar.scale = angle, scale
+
+            start = time.perf_counter()
+            render()
+            times.append(time.perf_counter() - start)
+
+        times.sort()
+        print(f"{name:12} mean {sum(times) / len(times) * 1000:7.2f}ms  "
+              f"p50 {times[len(times) // 2] * 1000:7.2f}ms  p99 {times[int(len(times) * 0.99)] * 1000:7.2f}ms")
+
+    avatar.shutdown()
+
+if __name__ == "__main__" and "--benchmark" in sys.argv:
+    run_benchmark()
+
+elif __name__ == "__main__":
     tts = AvatarApp()
     tts.start()
     tts.ack()
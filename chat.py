@@ -1,11 +1,15 @@
 from datetime import datetime
+from random import randint
 from time import time
 
 from restream import RestreamApp
+from twitch import TwitchApp
 from oauth import OAuthApp
+from dedup import DedupCache
 
 from logs import *
 from config import *
+from tracing import TRACER
 
 class ChatApp():
     token = None
@@ -15,6 +19,18 @@ class ChatApp():
         self.on_message_cb = on_message
         self.restream = RestreamApp(on_message=lambda m: self.on_message(m))
         self.oauth = OAuthApp("restream.io")
+
+        ## Read Twitch chat straight off Twitch as well as through Restream.
+        ## Whichever copy of a message arrives first is used, see DedupCache.
+        if CONFIG.getboolean("twitch.tv", "ingest", fallback=False):
+            self.twitch = TwitchApp(f"justinfan{randint(10000, 99999)}", CONFIG.get("streamer", "name"),
+                                    on_message=lambda m: self.on_message(m), read_only=True)
+        else:
+            self.twitch = None
+
+        self.dedup = DedupCache(CONFIG.getfloat("chat", "dedup_window", fallback=10.0),
+                                CONFIG.getint("chat", "dedup_size", fallback=1000))
+
         self.open_chat_log()
 
     def ensure_connected(self):
@@ -26,10 +42,19 @@ class ChatApp():
                 self.log.info("Token received.  Starting Restream Server..")
                 self.restream.start(self.token)
 
+        if self.twitch and not self.twitch.running:
+            self.log.info("Starting Twitch chat ingest..")
+            self.twitch.start()
+
     def shutdown(self):
         self.restream.shutdown()
         self.oauth.shutdown()
 
+        if self.twitch:
+            self.twitch.shutdown()
+
+        self.log.info(f"Duplicate messages {self.dedup.stats()}")
+
         if self.chat_log_file:
             self.chat_log({'author': 'METACHAT', 'text': f"*** Chat session ended ***"})
             self.chat_log_file.close()
@@ -58,6 +83,16 @@ class ChatApp():
             self.chat_log_file.flush()
 
     def on_message(self, message):
+        if self.dedup.is_duplicate(message):
+            self.log.debug(f"Skipping duplicate message from {message['author']}, {self.dedup.stats()}")
+            return
+
+        # Messages the streamer said come back from Twitch with no trace, so
+        # look it up by text before starting a new one
+        if not message.get('trace'):
+            message['trace'] = TRACER.trace_for_text(message['text'] or "") or TRACER.new_trace()
+
+        TRACER.mark(message['trace'], "chat.received")
         self.on_message_cb(message)
         self.chat_log(message)
 
@@ -1,10 +1,10 @@
 from random import random, randint
-import os
 import re
 import time
 import number_parser
 import json
 import traceback
+import uuid
 
 import wordlist
 
@@ -16,6 +16,10 @@ from avatar import AvatarApp
 from webserver import WebserverApp
 
 from macros import Macros
+from history import HistoryLog
+from classifier import MessageClassifier
+from speechqueue import PRIORITIES, priority_for
+from tracing import TRACER
 
 from config import *
 from logs import *
@@ -23,18 +27,19 @@ from logs import *
 class ChatbotApp():
     token = None
 
-    def __init__(self, on_say=None):
+    def __init__(self, on_say=None, scheduler=None):
         self.log = Logger("chatbot")
-        self.history = []
         self.on_say = on_say
 
         self.name = CONFIG.get("chatbot", "name")
         self.streamer_name = CONFIG.get("streamer", "name")
         self.history_size = CONFIG.getint("chatbot", "history_size", fallback=100)
         self.history_path = CONFIG.get("chatbot", "history_path", fallback=None)
+        self.history_compact_every = CONFIG.getint("chatbot", "history_compact_every", fallback=self.history_size)
         self.nicknames = CONFIG.get("chatbot", "nicknames")
         self.reply_mode = CONFIG.get("chatbot", "reply_mode", fallback="conversation")
         self.bang_pattern = CONFIG.get("bangs", "pattern", fallback=None)
+        self.classifier = MessageClassifier(self.name, self.streamer_name, self.nicknames, self.bang_pattern)
 
         self.last_message_time = 0
         self.last_interaction_time = 0
@@ -58,7 +63,7 @@ class ChatbotApp():
         if CONFIG.getboolean("chatbot", "send_to_tts", fallback=False):
             self.tts = TTSApp()
         elif CONFIG.getboolean("chatbot", "send_to_avatar", fallback=False):
-            self.tts = AvatarApp()
+            self.tts = AvatarApp(scheduler=scheduler)
         else:
             self.tts = None
 
@@ -90,25 +95,18 @@ class ChatbotApp():
         if self.webserver:
             self.webserver.shutdown()
 
+        self.chatgpt.shutdown()
+        self.history_log.close()
+
     def load_history(self):
-        if self.history_path and os.path.exists(self.history_path):
-            with open(self.history_path, "r") as fil:
-                history_data = fil.read()
-                self.history = json.loads(history_data)
+        self.history_log = HistoryLog(self.history_path, self.history_size, self.history_compact_every)
+        self.history = self.history_log.messages
 
     def save_history(self):
-        if self.history_path:
-            with open(self.history_path, "w") as fil:
-                history_data = json.dumps(self.history)
-                fil.write(history_data)
+        self.history_log.compact()
 
     def append_to_history(self, message):
-        self.history.append(message)
-
-        while len(self.history) >= self.history_size:
-            self.history.pop(0)
-        
-        self.save_history()
+        self.history_log.append(message)
 
     def on_voice(self, text):
         self.log.debug(f"Got voice: {text}")
@@ -143,53 +141,55 @@ class ChatbotApp():
                 self.log.warning(f"Got unexpected empty message.  Returning early.")
                 return
 
-            if self.is_bang_command(message):
-                self.process_bang_command(message)
+            # Run all the intent checks once up front
+            classification = self.classifier.classify(message)
+
+            if classification.bang_command:
+                self.process_bang_command(message, classification)
                 return
             
             # Process as command if needed        
-            if self.is_voice_command(message):
-                self.process_voice_command(message)
+            if classification.voice_command:
+                self.process_voice_command(message, classification)
                 return
 
             # Record last message/interaction times
-            if self.is_from_me(message):
+            if classification.from_me:
                 self.last_message_time = time.time()
             
-            if not self.is_from_streamer(message):
+            if not classification.from_streamer:
                 self.last_interaction_time = time.time()
 
             # Add to our history log
             self.append_to_history(message)
 
             # Send a reply if needed
-            reply_context = self.should_reply(message)
+            reply_context = self.should_reply(message, classification)
             
             if reply_context:
+                reply_context['trace'] = message.get('trace')
                 self.reply(reply_context)
     
         except Exception as e:
             self.log.error("Caught exception in chatbot.on_message")
             self.log.error(traceback.format_exc())
     
+    ## Use the classification from on_message when we have one, otherwise
+    ## classify the message now
+    def classify(self, message, classification=None):
+        return classification or self.classifier.classify(message)
+
     def is_from_streamer(self, message):
         return message['author'] == self.streamer_name
     
     def is_from_me(self, message):
         return message['author'] == self.name
 
-    def is_bang_command(self, message):
-        if not self.bang_pattern:
-            self.log.error("No bang pattern defined.  Cannot process !commands")
-            return False
-        
-        result = re.search(self.bang_pattern, message['text'], re.IGNORECASE) is not None
+    def is_bang_command(self, message, classification=None):
+        return self.classify(message, classification).bang_command is not None
 
-        return result
-
-    def process_bang_command(self, message):
-        match = re.search(self.bang_pattern, message['text'], re.IGNORECASE)
-        cmd = match.group(1)
+    def process_bang_command(self, message, classification=None):
+        cmd = self.classify(message, classification).bang_command
 
         response = CONFIG.get("bangs", f"bang_{cmd}", fallback=None)
 
@@ -202,45 +202,37 @@ class ChatbotApp():
             
         self.log.info(f"Replying to !{cmd} with {response}")
 
-        self.say(response)
-
-    def is_voice_command(self, message):
-        pattern = f"\\bHey,? (?:{self.nicknames}),? please (.+)\\b"
-
-        if not self.is_from_streamer(message):
-            self.log.error(f"Ignoring command from {message['author']}")
-            return False
-
-        result = re.search(pattern, message['text'], re.IGNORECASE) is not None
+        # Viewers trigger these, so they mustn't cut off what's being said
+        self.say(response, PRIORITIES['activation'], stock=True)
 
-        return result
+    def is_voice_command(self, message, classification=None):
+        return self.classify(message, classification).voice_command is not None
     
-    def process_voice_command(self, message):
-        pattern = f"\\bHey,? (?:{self.nicknames}),? please (.+)\\b"
-        match = re.search(pattern, message['text'], re.IGNORECASE)
-        cmd = match.group(1)
+    def process_voice_command(self, message, classification=None):
+        cmd = self.classify(message, classification).voice_command
+        action = self.classifier.match_command(cmd)
 
         self.log.info(f"Processing voice command '{cmd}'")
 
-        if re.search("ignore", cmd, re.IGNORECASE) is not None:
+        if action == "ignore":
             self.process_ignore(cmd)
-        elif re.search("(?:change|set) the game to", cmd, re.IGNORECASE) is not None:
+        elif action == "game_change":
             self.process_game_change(cmd)
-        elif re.search("pin a message", cmd, re.IGNORECASE) is not None:
+        elif action == "pin_message":
             self.process_pin_message(cmd)
-        elif re.search("start a break", cmd, re.IGNORECASE) is not None:
+        elif action == "brb":
             self.process_brb(message)
-        elif re.search("bring us back", cmd, re.IGNORECASE) is not None:
+        elif action == "brb_back":
             self.process_brb_back(message)
-        elif re.search("tell me when (?:did )?i", cmd, re.IGNORECASE) is not None:
+        elif action == "when_i":
             self.process_when_i(message)
-        elif re.search("find the last clip", cmd, re.IGNORECASE) is not None:
+        elif action == "find_last_clip":
             self.process_find_last_clip(message)
-        elif re.search("(?:save|start|make) a clip", cmd, re.IGNORECASE) is not None:
+        elif action == "save_clip":
             self.process_save_clip(message)
-        elif re.search("(?:edit|trip|cut) the clip", cmd, re.IGNORECASE) is not None:
+        elif action == "edit_clip":
             self.process_edit_clip(message)
-        elif re.search("post (?:the|that) clip", cmd, re.IGNORECASE) is not None:
+        elif action == "post_clip":
             self.process_post_clip(message)
         else:
             self.log.error(f"Couldn't parse command: '{cmd}'")
@@ -387,13 +379,19 @@ class ChatbotApp():
 
     def process_when_i(self, message):
         self.append_to_history(message)
-        response = self.reply({
+        future = self.reply({
             "type":"history",
             "message": message,
             "prompt": ("Reply with a snarky message that includes \"t=TIME\", "
                        f"where `TIME` is your best guess of the time {self.streamer_name} is asking about.")
         })
+        future.add_done_callback(lambda f: self.on_when_i_response(f))
+
+    def on_when_i_response(self, future):
+        if future.cancelled() or future.exception() or not future.result():
+            return
 
+        response = future.result()
         pattern = "t=(\\d+)"
         match = re.search(pattern, response, re.IGNORECASE)
         if match:
@@ -402,13 +400,8 @@ class ChatbotApp():
             self.log.info(f"Got time {time_context} from message")
             self.context['time'] = time_context
 
-    def is_talking_to_me(self, message):
-        if self.is_from_me(message):
-            return False
-        
-        pattern = f"\\b({self.nicknames}|you|your|our)\\b"
-
-        result = re.search(pattern, message['text'], re.IGNORECASE) is not None
+    def is_talking_to_me(self, message, classification=None):
+        result = self.classify(message, classification).talking_to_me
     
         self.log.debug(f"is_talking_to_me={result}")
 
@@ -448,14 +441,8 @@ class ChatbotApp():
 
         return result
 
-    def is_a_question(self, message):
-        interrogative_pattern = '\\b(?:can you|what|who|where|how|why|do you|is it the|is it this|are you|are they)\\b'
-        punctuation_pattern = '\\?'
-        
-        result = (
-            re.search(interrogative_pattern, message['text'], re.IGNORECASE) is not None or
-            re.search(punctuation_pattern, message['text']) is not None
-        )
+    def is_a_question(self, message, classification=None):
+        result = self.classify(message, classification).question
 
         self.log.debug(f"is_a_question={result}")
 
@@ -468,10 +455,10 @@ class ChatbotApp():
         self.log.debug(f"Random {r}<{val} = {result}")
         return result
         
-    def is_in_conversation(self, message):
+    def is_in_conversation(self, message, classification=None):
         result = (
             (
-                self.is_a_question(message) or
+                self.is_a_question(message, classification) or
                 self.is_randomly(0.005)
             ) 
             
@@ -481,101 +468,74 @@ class ChatbotApp():
         self.log.debug(f"is_in_conversation={result}")
         return result
 
-    def is_activated(self, message):
-        if self.is_from_me(message):
-            return False
-        
-        pattern = f"\\b(hey|yes|yeah|no|nah|okay|thanks)?,?\\s*({self.nicknames})\\b"
-        
-        result = re.search(pattern, message['text'], re.IGNORECASE) is not None
+    def is_activated(self, message, classification=None):
+        result = self.classify(message, classification).activated
     
         self.log.debug(f"is_activated={result}")
 
         return result
 
-    def is_boredom_request(self, message):
-        pattern = f"\\b(bored|tell me something|i'm board|i am board)"
-
-        result = re.search(pattern, message['text'], re.IGNORECASE) is not None
+    def is_boredom_request(self, message, classification=None):
+        result = self.classify(message, classification).boredom_request
     
         if result:
             self.log.debug(f"Message matches is_boredom_request")
 
         return result
 
-    def is_code_request(self, message):
-        pattern = f"\\b(write|create|make|give|show|build)\\b.*?\\b(code|snippet|script|function|method|class|object|variable|constant|macro)\\b"
-
-        result = re.search(pattern, message['text'], re.IGNORECASE) is not None
+    def is_code_request(self, message, classification=None):
+        result = self.classify(message, classification).code_request
     
         if result:
             self.log.debug(f"Message matches is_code_request")
 
         return result
 
-    def is_discussion_continued(self, message):
+    def is_discussion_continued(self, message, classification=None):
         if self.is_from_me(message):
             return False
         
         return (
-            self.is_talking_to_me(message) and
+            self.is_talking_to_me(message, classification) and
             self.time_since_last_message_or_tts() < 15 and
             not self.just_spoke(message)
         )
     
-    def contains_link(self, message):
-        pattern = "\\w+\\.\\w+\/\\w+"
+    def is_likely_spam(self, message, classification=None):
+        classification = self.classify(message, classification)
 
-        result = re.search(pattern, message['text']) is not None
+        if classification.spam_matches:
+            self.log.debug(f"Message spam matches={classification.spam_matches}")
 
-        return result
-    
-    def is_likely_spam(self, message):
-        if self.is_from_me(message) or self.is_from_streamer(message):
-            return False
+        return classification.likely_spam
 
-        matches = 0
-        if self.contains_link(message):
-            self.log.debug(f"Message contains link, spam matches={matches}")
-            matches += 1
-
-        pattern = '\\b(cheap|best|viewers|google|remove the space)\\b'
-        if re.search(pattern, message['text'], re.IGNORECASE) is not None:
-            self.log.debug(f"Message contains spam language, spam matches={matches}")
-            matches += 1
-
-        if not message['text'].isascii():
-            self.log.debug(f"Message contains unicode, spam matches={matches}")
-            matches += 1
-
-        return matches > 1
-
-    def should_reply_activation(self, message):
+    def should_reply_activation(self, message, classification=None):
+        classification = self.classify(message, classification)
         result = False
 
-        if self.is_likely_spam(message):
+        if self.is_likely_spam(message, classification):
             self.log.debug("Replying to likely spam")
             result = {
                 "type": "spam",
                 "prompt": "Reply to someone sending spam."
             }
         
-        elif self.is_discussion_continued(message):
+        elif self.is_discussion_continued(message, classification):
             self.log.debug("Replying to continued discussion")
             result = {
                 "type": "discussion",
                 "prompt": "Reply a continued converation."
             }
 
-        elif self.is_activated(message):
+        elif self.is_activated(message, classification):
             self.log.debug("Replying to activation")
 
-            if self.is_boredom_request(message):
+            if self.is_boredom_request(message, classification):
                 result = {
                     "type": "boredom",
                     "prompt": self.reply_boredom_ideas()
                 }
-            elif self.is_code_request(message):
+            elif self.is_code_request(message, classification):
                 result = {
                     "type": "code",
                     "prompt": "Reply with code snippet.  Enclose the code in triple backticks.",
@@ -612,11 +572,12 @@ class ChatbotApp():
         return (f"Reply with {idea} about this subject: \"{subject}\". "
                 f"Start your reply with \"Here's {idea} about {subject}.\"")
 
-    def should_reply_legacy(self, message):
+    def should_reply_legacy(self, message, classification=None):
+        classification = self.classify(message, classification)
         result = (
-            self.is_talking_to_me(message) or
+            self.is_talking_to_me(message, classification) or
             self.time_since_last_message() > 300 or
-            self.is_in_conversation(message)
+            self.is_in_conversation(message, classification)
         ) and (
             not self.just_spoke(message) or
             self.is_randomly(0.1)
@@ -630,11 +591,11 @@ class ChatbotApp():
 
         return result
 
-    def should_reply(self, message):
+    def should_reply(self, message, classification=None):
         if self.reply_mode == "activation":
-            return self.should_reply_activation(message)
+            return self.should_reply_activation(message, classification)
         else:
-            return self.should_reply_legacy(message)
+            return self.should_reply_legacy(message, classification)
 
     def is_code_response(self, response):
         return re.search("```", response) is not None
@@ -648,17 +609,53 @@ class ChatbotApp():
             self.tts.ack()
 
         self.log.info("Getting response")
-        response = self.chatgpt.get_response(self.history, context)
+        # Sentences are said as they stream in rather than when the whole
+        # response is done
+        priority = priority_for(context['type'])
+        trace = context.get('trace')
+        TRACER.mark(trace, "chatbot.reply")
+
+        # The speech queue keeps a reply's sentences together by trace, so
+        # replies that aren't traced (boredom) still need an id
+        trace = trace or uuid.uuid4().hex[:12]
+
+        future = self.chatgpt.submit_response(self.history_log.snapshot(), context,
+                                              on_sentence=lambda s: self.say(s, priority, trace))
+        future.add_done_callback(lambda f: self.on_response(f))
 
-        self.log.info(f"Responding with '{response}'")
-        self.say(response)
+        return future
 
-        return response
+    def on_response(self, future):
+        if future.cancelled():
+            return
+
+        try:
+            response = future.result()
+        except Exception as e:
+            self.log.error("Caught exception getting response")
+            self.log.error(traceback.format_exc())
+            return
+
+        if response is None:
+            self.log.error("Got no response to reply with")
+            return
+
+        self.log.info(f"Responded with '{response}'")
 
     def strip_code(self, message):
         return re.sub("```.*?(?:```\n*|$)", "", message, flags=re.DOTALL)
 
-    def say(self, message):
+    ## priority decides what gets spoken first when the speech queue backs up.
+    ## Command confirmations go first, everything else defaults to discussion.
+    ## stock lines are said over and over (bangs, confirmations) so they're
+    ## worth caching the speech for.
+    def say(self, message, priority=None, trace=None, stock=None):
+        if priority is None:
+            priority = PRIORITIES['command'] if message.startswith("[cmd]") else PRIORITIES['discussion']
+
+        if stock is None:
+            stock = message.startswith("[cmd]")
+
         if self.webserver and self.is_code_response(message):
             self.webserver.say(message)
             message = self.strip_code(message)
@@ -668,9 +665,9 @@ class ChatbotApp():
                 message = "sure, take a look at this."
             
         # If we're sending to twitch, we don't need to call on_say since the
-        # message will come back through restream
+        # message will come back through restream (or Twitch ingest)
         if self.twitch:
-            self.twitch.say(message)
+            self.twitch.say(message, trace)
         elif self.on_say:
             msg = {
                 "author": self.name,
@@ -680,14 +677,11 @@ class ChatbotApp():
             self.on_say(msg)
         
         if self.tts:
-            self.tts.say(message)
+            self.tts.say(message, priority, trace, stock)
         
         self.last_interaction_time = time.time()
         self.last_message_time = time.time()
 
-    def tick(self):
-        self.tts.tick()
-
 def run_tests():
     data = {
         'bot_name': "testbot",
@@ -700,6 +694,7 @@ def run_tests():
 
     t = time.time()
     chatbot.nicknames = "bot|robot|chat|bob|bobby"
+    chatbot.classifier = MessageClassifier(chatbot.name, chatbot.streamer_name, chatbot.nicknames, chatbot.bang_pattern)
     chatbot.history = [
         { "author": "testttv", "text": "Hello bot", "sent": t-30 },
         { "author": "testbot", "text": "Hi there!", "sent": t-15 },
@@ -739,7 +734,7 @@ def run_interactive():
     chatbot.tts.start()
 
     class MockTwitch:
-        def say(self, message):
+        def say(self, message, trace=None):
             chatbot.history.append({ "author": chatbot.name, "text": message, "sent": time.time() })
             print(f"{chatbot.name}: {message}")
 
@@ -2,13 +2,20 @@ import os
 import re
 import random
 import time
+from concurrent.futures import ThreadPoolExecutor
+
 import openai
 
 from config import *
 from logs import *
+from tracing import TRACER
 
 openai.api_key = SECRETS.get("openai.com", "token")
 
+## Words that end in a period without ending the sentence.  "No." only
+## counts when a number follows, like "No. 5".
+ABBREVIATIONS = { "e.g", "i.e", "etc", "vs", "mr", "mrs", "ms", "dr", "st", "jr", "sr", "approx" }
+
 class CompletionApp():
     def __init__(self):
         self.log = Logger("chatgpt")
@@ -24,7 +31,17 @@ class CompletionApp():
         self.max_tokens = CONFIG.getint("openai.com", "max_tokens", fallback=256)
         self.max_tokens_code = CONFIG.getint("openai.com", "max_tokens_code", fallback=32767)
         self.max_tokens_boredom = CONFIG.getint("openai.com", "max_tokens_boredom", fallback=512)
+        self.stream = CONFIG.getboolean("openai.com", "stream", fallback=False)
+        self.min_sentence_length = CONFIG.getint("openai.com", "min_sentence_length", fallback=12)
 
+        ## Completions run on a small pool so a slow request (code model) never
+        ## holds up the chat thread that asked for it.
+        self.max_inflight = CONFIG.getint("openai.com", "max_inflight", fallback=2)
+        self.executor = ThreadPoolExecutor(max_workers=self.max_inflight,
+                                           thread_name_prefix="completion")
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
 
     def get_template_data(self):
         data = {
@@ -201,6 +218,106 @@ class CompletionApp():
             self.log.error(messages)
             return None    
 
+    def get_completion_stream(self, model, tokens, messages):
+        try:
+            response = openai.ChatCompletion.create(
+                model=model,
+                messages=messages,
+                temperature=0.8,
+                max_tokens=tokens,
+                frequency_penalty=0.5,
+                presence_penalty=0.0,
+                stop=[ f"{self.name}:", f"{self.streamer}:" ],
+                stream=True
+            )
+
+            for chunk in response:
+                delta = chunk['choices'][0]['delta']
+                if delta.get('content'):
+                    yield delta['content']
+
+        except Exception as e:
+            self.log.error(f"OpenAI Chat API stream failed: {e}")
+            self.log.error(messages)
+
+    ## Group streamed tokens into sentences.  A sentence is only cut once the
+    ## next one has started so trailing emoji stay with the sentence they
+    ## belong to, and anything from a code block onwards is kept in one piece.
+    ## Periods after abbreviations, initials and list numbers don't end a
+    ## sentence, and anything shorter than min_sentence_length is kept with
+    ## the sentence after it.
+    def split_sentences(self, tokens):
+        buffer = ""
+        start = 0
+        pattern = re.compile("[.!?]+(?:\\s*[^\\w\\s]+)*\\s+(?=[\\w\"'])|\\n+")
+
+        for token in tokens:
+            buffer += token
+
+            while "```" not in buffer:
+                match = pattern.search(buffer, start)
+                if match is None:
+                    break
+
+                sentence = buffer[:match.end()].strip()
+
+                if (self.is_partial_sentence(buffer[:match.start()], match.group(), buffer[match.end():]) or
+                        len(sentence) < self.min_sentence_length):
+                    start = match.end()
+                    continue
+
+                buffer = buffer[match.end():]
+                start = 0
+
+                if sentence:
+                    yield sentence
+
+        if buffer.strip():
+            yield buffer.strip()
+
+    ## Whether a period between head and tail is part of the sentence rather
+    ## than the end of it, like "e.g." or "Mr." or "3." or "J."
+    def is_partial_sentence(self, head, punctuation, tail):
+        words = head.split()
+        if not punctuation.startswith(".") or not words:
+            return False
+
+        word = words[-1]
+        initial = len(word) == 1 and word.isalpha() and word != "I"
+        number = word.lower() == "no" and tail[:1].isdigit()
+
+        return word.lower() in ABBREVIATIONS or word.isdigit() or initial or number
+
+    def stream_response(self, history, context):
+        if not self.stream or self.api != "chat" or context['type'] in ('code', 'clip'):
+            response = self.get_response(history, context)
+            if response:
+                yield response
+            return
+
+        messages = self.get_chat_messages(history, context)
+        tokens = self.max_tokens
+
+        if context['type'] == 'boredom':
+            tokens = self.max_tokens_boredom
+
+        yield from self.split_sentences(self.get_completion_stream(self.model, tokens, messages))
+
+    def get_streamed_response(self, history, context, on_sentence):
+        trace = context.get('trace')
+        span = TRACER.span(trace, "openai.completion")
+        sentences = []
+
+        for sentence in self.stream_response(history, context):
+            if not sentences:
+                TRACER.mark(trace, "openai.first_sentence")
+
+            on_sentence(sentence)
+            sentences.append(sentence)
+
+        span.end()
+        return " ".join(sentences) or None
+
     def get_chat_response(self, history, context):
         messages = self.get_chat_messages(history, context)
         model = self.model
@@ -252,6 +369,15 @@ class CompletionApp():
         else:
             self.log.error(f"Invalid chatgpt api: {self.api}")
             return None
+
+    ## Queue a completion and return a Future for its text.  The history is
+    ## copied now so later chat messages don't change the prompt underneath it.
+    ## If on_sentence is given it's called with each sentence as it streams in.
+    def submit_response(self, history, context, on_sentence=None):
+        if on_sentence:
+            return self.executor.submit(self.get_streamed_response, list(history), context, on_sentence)
+
+        return self.executor.submit(self.get_response, list(history), context)
         
 if __name__ == "__main__":
     history_string = "potate_oh_no: Hello bot."
@@ -0,0 +1,169 @@
+import re
+import time
+
+from config import *
+from logs import *
+
+''' Everything the chatbot wants to know about one message '''
+class Classification():
+    def __init__(self):
+        self.from_me = False
+        self.from_streamer = False
+        self.bang_command = None
+        self.voice_command = None
+        self.talking_to_me = False
+        self.activated = False
+        self.boredom_request = False
+        self.code_request = False
+        self.question = False
+        self.spam_matches = 0
+
+    @property
+    def likely_spam(self):
+        return self.spam_matches > 1
+
+''' Classifies chat messages for the chatbot.
+
+    All patterns are compiled once from config, and classify() runs each of
+    them at most once per message, so the chatbot's intent checks don't
+    rebuild and re-search their regexes over and over.
+'''
+class MessageClassifier():
+    command_patterns = [
+        ("ignore", "ignore"),
+        ("game_change", "(?:change|set) the game to"),
+        ("pin_message", "pin a message"),
+        ("brb", "start a break"),
+        ("brb_back", "bring us back"),
+        ("when_i", "tell me when (?:did )?i"),
+        ("find_last_clip", "find the last clip"),
+        ("save_clip", "(?:save|start|make) a clip"),
+        ("edit_clip", "(?:edit|trip|cut) the clip"),
+        ("post_clip", "post (?:the|that) clip")
+    ]
+
+    def __init__(self, name, streamer_name, nicknames, bang_pattern=None):
+        self.log = Logger("classifier")
+        self.name = name
+        self.streamer_name = streamer_name
+
+        if bang_pattern:
+            self.bang_re = re.compile(bang_pattern, re.IGNORECASE)
+        else:
+            self.log.error("No bang pattern defined.  Cannot process !commands")
+            self.bang_re = None
+
+        self.voice_re = re.compile(f"\\bHey,? (?:{nicknames}),? please (.+)\\b", re.IGNORECASE)
+        self.talking_re = re.compile(f"\\b({nicknames}|you|your|our)\\b", re.IGNORECASE)
+        self.activated_re = re.compile(f"\\b(hey|yes|yeah|no|nah|okay|thanks)?,?\\s*({nicknames})\\b", re.IGNORECASE)
+        self.boredom_re = re.compile("\\b(bored|tell me something|i'm board|i am board)", re.IGNORECASE)
+        self.code_re = re.compile("\\b(write|create|make|give|show|build)\\b.*?\\b(code|snippet|script|function|method|"
+                                  "class|object|variable|constant|macro)\\b", re.IGNORECASE)
+        self.question_re = re.compile("\\b(?:can you|what|who|where|how|why|do you|is it the|is it this|are you|are they)\\b|\\?",
+                                      re.IGNORECASE)
+        self.link_re = re.compile("\\w+\\.\\w+/\\w+")
+        self.spam_re = re.compile("\\b(cheap|best|viewers|google|remove the space)\\b", re.IGNORECASE)
+
+        self.command_res = [(action, re.compile(pattern, re.IGNORECASE)) for (action, pattern) in self.command_patterns]
+
+    def classify(self, message):
+        text = message['text']
+        result = Classification()
+
+        result.from_me = message['author'] == self.name
+        result.from_streamer = message['author'] == self.streamer_name
+
+        if self.bang_re:
+            match = self.bang_re.search(text)
+            if match:
+                result.bang_command = match.group(1)
+
+        if result.from_streamer:
+            match = self.voice_re.search(text)
+            if match:
+                result.voice_command = match.group(1)
+
+        if not result.from_me:
+            result.talking_to_me = self.talking_re.search(text) is not None
+            result.activated = self.activated_re.search(text) is not None
+
+        result.boredom_request = self.boredom_re.search(text) is not None
+        result.code_request = self.code_re.search(text) is not None
+        result.question = self.question_re.search(text) is not None
+
+        if not result.from_me and not result.from_streamer:
+            if self.link_re.search(text):
+                result.spam_matches += 1
+            if self.spam_re.search(text):
+                result.spam_matches += 1
+            if not text.isascii():
+                result.spam_matches += 1
+
+        return result
+
+    ## Map the text of a voice command to the name of the action it asks for
+    def match_command(self, cmd):
+        for (action, pattern) in self.command_res:
+            if pattern.search(cmd):
+                return action
+
+        return None
+
+## Per-message checks the way the chatbot used to do them, for comparison
+def classify_legacy(message, name, streamer_name, nicknames, bang_pattern):
+    text = message['text']
+    from_me = message['author'] == name
+    from_streamer = message['author'] == streamer_name
+
+    re.search(bang_pattern, text, re.IGNORECASE)
+    if from_streamer:
+        re.search(f"\\bHey,? (?:{nicknames}),? please (.+)\\b", text, re.IGNORECASE)
+
+    if not from_me and not from_streamer:
+        re.search("\\w+\\.\\w+\/\\w+", text)
+        re.search('\\b(cheap|best|viewers|google|remove the space)\\b', text, re.IGNORECASE)
+
+    if not from_me:
+        re.search(f"\\b({nicknames}|you|your|our)\\b", text, re.IGNORECASE)
+        re.search(f"\\b(hey|yes|yeah|no|nah|okay|thanks)?,?\\s*({nicknames})\\b", text, re.IGNORECASE)
+
+    re.search(f"\\b(bored|tell me something|i'm board|i am board)", text, re.IGNORECASE)
+    re.search(f"\\b(write|create|make|give|show|build)\\b.*?\\b(code|snippet|script|function|method|class|object|"
+              f"variable|constant|macro)\\b", text, re.IGNORECASE)
+    re.search('\\b(?:can you|what|who|where|how|why|do you|is it the|is it this|are you|are they)\\b', text, re.IGNORECASE)
+    re.search('\\?', text)
+
+def run_benchmark(count=100000):
+    name = CONFIG.get("chatbot", "name")
+    streamer_name = CONFIG.get("streamer", "name")
+    nicknames = CONFIG.get("chatbot", "nicknames")
+    bang_pattern = CONFIG.get("bangs", "pattern")
+
+    messages = [
+        { "author": "viewer", "text": "Hey bobby, can you write me a python function?" },
+        { "author": "viewer", "text": "lol that was great" },
+        { "author": "viewer", "text": "Best viewers cheap at google dot com/abc remove the space" },
+        { "author": streamer_name, "text": "Hey bobby, please start a break" },
+        { "author": streamer_name, "text": "I think this is the one we want to go with" },
+        { "author": name, "text": "sure, take a look at this." },
+        { "author": "viewer", "text": "!discord" },
+        { "author": "viewer", "text": "i'm bored, tell me something" }
+    ]
+
+    classifier = MessageClassifier(name, streamer_name, nicknames, bang_pattern)
+
+    start = time.perf_counter()
+    for i in range(count):
+        classify_legacy(messages[i % len(messages)], name, streamer_name, nicknames, bang_pattern)
+    legacy = count / (time.perf_counter() - start)
+
+    start = time.perf_counter()
+    for i in range(count):
+        classifier.classify(messages[i % len(messages)])
+    compiled = count / (time.perf_counter() - start)
+
+    print(f"legacy:   {legacy:12.0f} messages/sec")
+    print(f"compiled: {compiled:12.0f} messages/sec ({compiled / legacy:.1f}x)")
+
+if __name__ == "__main__":
+    run_benchmark()
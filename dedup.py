@@ -0,0 +1,106 @@
+import hashlib
+from collections import OrderedDict, deque
+from itertools import count
+from threading import Lock
+from time import time
+
+from config import *
+from logs import *
+
+''' Remembers recent chat messages so the same one isn't handled twice.
+
+    Messages with an id are keyed on their platform and id, which catches
+    redeliveries (Restream replays events when it reconnects).  Every
+    message is also keyed on a hash of its author and text, which catches
+    the same message coming in from two places (Twitch directly and through
+    Restream).  Every copy of a hash is remembered with its platform.  A copy
+    from another platform uses up the oldest unmatched one, so someone
+    saying the same thing twice is heard twice, and only once per platform.
+
+    Entries are forgotten after window seconds, or once there are more than
+    max_entries of them.
+'''
+class DedupCache():
+    def __init__(self, window=10.0, max_entries=1000):
+        self.log = Logger("dedup")
+        self.window = window
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.copies = {}
+        self.ids = count()
+        self.lock = Lock()
+        self.checked = 0
+        self.suppressed_by_id = 0
+        self.suppressed_by_content = 0
+
+    def keys(self, message):
+        platform = message.get('platform') or "local"
+        content = hashlib.sha1(f"{message['author']}\n{message['text']}".encode("utf-8")).hexdigest()
+
+        id_key = ("id", platform, message['id']) if message.get('id') else None
+        return platform, id_key, content
+
+    def is_duplicate(self, message):
+        platform, id_key, content = self.keys(message)
+        now = time()
+
+        with self.lock:
+            self.expire(now)
+            self.checked += 1
+
+            duplicate = False
+            if id_key and id_key in self.entries:
+                self.suppressed_by_id += 1
+                duplicate = True
+            elif self.match(content, platform):
+                self.suppressed_by_content += 1
+                duplicate = True
+            else:
+                content_key = ("content", content, next(self.ids))
+                self.entries[content_key] = (now, platform)
+                self.copies.setdefault(content, deque()).append((content_key, platform))
+
+            # Duplicates only refresh their id, so they can't match anything new
+            if id_key:
+                self.entries.pop(id_key, None)
+                self.entries[id_key] = (now, platform)
+
+            while len(self.entries) > self.max_entries:
+                self.forget(*self.entries.popitem(last=False))
+
+            return duplicate
+
+    ## Use up the oldest unmatched copy of content from another platform
+    def match(self, content, platform):
+        copies = self.copies.get(content, ())
+
+        for (key, other) in copies:
+            if other != platform:
+                copies.remove((key, other))
+                if not copies:
+                    del self.copies[content]
+
+                self.entries.pop(key)
+                return True
+
+        return False
+
+    ## Entries go oldest first, so a content copy is the oldest of its hash
+    def forget(self, key, entry):
+        if key[0] == "content":
+            copies = self.copies[key[1]]
+            copies.popleft()
+            if not copies:
+                del self.copies[key[1]]
+
+    def expire(self, now):
+        while self.entries and next(iter(self.entries.values()))[0] < now - self.window:
+            self.forget(*self.entries.popitem(last=False))
+
+    def stats(self):
+        with self.lock:
+            return {
+                "checked": self.checked,
+                "suppressed_by_id": self.suppressed_by_id,
+                "suppressed_by_content": self.suppressed_by_content
+            }
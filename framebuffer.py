@@ -0,0 +1,69 @@
+import os
+import mmap
+import struct
+import time
+
+from config import *
+from logs import *
+
+''' Ring buffer of raw video frames in a memory mapped file.
+
+    Layout is a 64 byte header followed by `slots` frames of height * stride
+    bytes each.  The header is:
+
+        magic "MCFB", version, width, height, stride, slots, pixel format
+        (e.g. "BGRA"), frame number, slot of the latest frame, and the time it
+        was written.
+
+    Each frame is written into the slot after the last one and the header is
+    updated afterwards, so a reader that copies the latest slot has `slots - 1`
+    frames worth of time before it gets overwritten.  Readers can compare the
+    frame number before and after copying to detect that.
+'''
+class FrameBuffer():
+    MAGIC = b"MCFB"
+    VERSION = 1
+    HEADER = struct.Struct("<4sIIIII4sQIId")
+    HEADER_SIZE = 64
+
+    def __init__(self, path, width, height, stride, pixel_format, slots=3):
+        self.log = Logger("framebuffer")
+        self.path = path
+        self.width = width
+        self.height = height
+        self.stride = stride
+        self.pixel_format = pixel_format
+        self.slots = slots
+        self.frame_size = stride * height
+        self.frame = 0
+        self.slot = 0
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        size = self.HEADER_SIZE + self.frame_size * slots
+
+        with open(path, "w+b") as fil:
+            fil.truncate(size)
+            self.map = mmap.mmap(fil.fileno(), size)
+
+        self.write_header(0)
+        self.log.info(f"Publishing {width}x{height} {pixel_format} frames to {path}")
+
+    def write_header(self, written):
+        self.map[0:self.HEADER.size] = self.HEADER.pack(self.MAGIC, self.VERSION, self.width, self.height,
+                                                        self.stride, self.slots, self.pixel_format.encode(),
+                                                        self.frame, self.slot, 0, written)
+
+    ## pixels is anything supporting the buffer protocol with exactly one
+    ## frame of bytes, such as a surface's get_buffer()
+    def publish(self, pixels):
+        slot = (self.slot + 1) % self.slots
+        start = self.HEADER_SIZE + slot * self.frame_size
+
+        self.map[start:start + self.frame_size] = pixels
+
+        self.slot = slot
+        self.frame += 1
+        self.write_header(time.time())
+
+    def close(self):
+        self.map.close()
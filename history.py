@@ -0,0 +1,119 @@
+import os
+import json
+from collections import deque
+from threading import Lock
+
+from config import *
+from logs import *
+
+''' Bounded chat history backed by a snapshot file plus an append-only journal.
+
+    Every message is appended to the journal as one JSON line, so persisting a
+    message costs one small write regardless of history size.  Every
+    compact_every appends the in-memory history is written out as a fresh
+    snapshot and the journal is truncated.  On startup the snapshot is loaded
+    and the journal replayed on top of it, so a crash loses nothing that made
+    it to the journal.
+
+    Messages are numbered as they're appended and the snapshot keeps the
+    number of the last one in it, so if we crash after writing a snapshot
+    but before truncating the journal, what's already in the snapshot isn't
+    replayed twice.
+'''
+class HistoryLog():
+    def __init__(self, path, size, compact_every=None):
+        self.log = Logger("history")
+        self.path = path
+        self.journal_path = path and f"{path}.journal"
+        self.size = size
+        self.compact_every = compact_every or size
+        self.messages = deque(maxlen=size)
+        self.appends = 0
+        self.seq = 0
+        self.journal = None
+        self.lock = Lock()
+
+        self.load()
+
+    def load(self):
+        if not self.path:
+            return
+
+        if os.path.exists(self.path):
+            with open(self.path, "r") as fil:
+                snapshot = json.loads(fil.read())
+
+            # Snapshots used to be a bare list of messages
+            if isinstance(snapshot, list):
+                snapshot = { "seq": 0, "messages": snapshot }
+
+            self.messages.extend(snapshot['messages'])
+            self.seq = snapshot['seq']
+
+        replayed = 0
+        if os.path.exists(self.journal_path):
+            with open(self.journal_path, "r") as fil:
+                for line in fil:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A torn last line from a crash mid-write
+                        self.log.warning("Skipping unreadable history journal line")
+                        continue
+
+                    if entry['seq'] <= self.seq:
+                        continue
+
+                    self.messages.append(entry['message'])
+                    self.seq = entry['seq']
+                    replayed += 1
+
+        if replayed:
+            self.log.info(f"Replayed {replayed} messages from {self.journal_path}")
+
+        self.compact()
+
+    def append(self, message):
+        with self.lock:
+            self.messages.append(message)
+
+            if not self.path:
+                return
+
+            if self.journal is None:
+                self.journal = open(self.journal_path, "a")
+
+            self.seq += 1
+            self.journal.write(json.dumps({ "seq": self.seq, "message": message }) + "\n")
+            self.journal.flush()
+
+            self.appends += 1
+            if self.appends >= self.compact_every:
+                self.compact()
+
+    ## Write the current history as a new snapshot and start an empty journal.
+    ## The snapshot is written to a temp file and renamed into place so a crash
+    ## leaves either the old or the new snapshot, never a partial one.
+    def compact(self):
+        if not self.path:
+            return
+
+        if self.journal:
+            self.journal.close()
+            self.journal = None
+
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as fil:
+            fil.write(json.dumps({ "seq": self.seq, "messages": list(self.messages) }))
+        os.replace(tmp_path, self.path)
+
+        open(self.journal_path, "w").close()
+        self.appends = 0
+
+    def snapshot(self):
+        with self.lock:
+            return list(self.messages)
+
+    def close(self):
+        with self.lock:
+            self.compact()
@@ -1,3 +1,4 @@
+import os
 import logging
 
 from datetime import datetime
@@ -22,6 +23,7 @@ def Logger(name):
     log_path = CONFIG.get("DEFAULT", "log_path", vars=data, fallback=None)
 
     if log_path:
+        os.makedirs(os.path.dirname(log_path) or ".", exist_ok=True)
         handler = logging.FileHandler(log_path, "a", "utf-8")
         handler.setFormatter(formatter)
         logger.addHandler(handler)
@@ -1,13 +1,12 @@
 
 from datetime import datetime
 from http.server import BaseHTTPRequestHandler, HTTPServer
-from time import sleep
-from queue import Queue
 
 from chat import ChatApp
 from streamer import StreamerApp
 from chatbot import ChatbotApp
 from reactions import ReactionsApp
+from scheduler import Scheduler
 
 from config import *
 from logs import *
@@ -22,14 +21,16 @@ class Application():
 
     def __init__(self):
         self.log = Logger("metachat")
+        self.scheduler = Scheduler()
+        self.connect_interval = CONFIG.getfloat("scheduler", "connect_interval", fallback=3.0)
+
         self.chat = ChatApp(on_message=lambda m: self.on_message(m))
         self.streamer = StreamerApp(on_say=lambda m: self.chat.on_message(m),
                                     on_voice=lambda t: self.on_voice(t))
-        self.chatbot = ChatbotApp(on_say=lambda m: self.on_message(m))
+        self.chatbot = ChatbotApp(on_say=lambda m: self.on_message(m),
+                                  scheduler=self.scheduler)
         self.reactions = ReactionsApp()
 
-        self.queue = Queue()
-
     def start(self):
         self.log.info(f"Application started on {datetime.now().strftime('%c')}..")
         self.running = True
@@ -47,21 +48,15 @@ class Application():
         self.chatbot.shutdown()
         self.reactions.shutdown()
 
-    def tick(self):
-        self.chatbot.tick()
-    
     def loop(self):
-        framecount = 0
+        # Nothing runs on a fixed frame rate anymore.  Connections are checked
+        # on a timer and everything else (avatar frames, speech) is woken up by
+        # the events that need it.
+        self.scheduler.call_every(self.connect_interval, self.ensure_connected, delay=0)
+
         while self.running:
             try:
-                framecount += 1
-
-                if framecount % 180 == 0:
-                    self.ensure_connected()
-
-                self.tick()
-
-                sleep(1/60.0)
+                self.scheduler.run_once()
             except KeyboardInterrupt:
                 break
             except Exception as ex:
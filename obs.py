@@ -1,4 +1,7 @@
 
+import time
+from threading import RLock, Thread
+
 from config import *
 from logs import *
 
@@ -12,18 +15,58 @@ class ObsApp:
         return cls.instance
     
     def __init__(self):
+        # Every app shares the one instance, so only set it up the first time
+        if hasattr(self, 'log'):
+            return
+
         self.log = Logger("obs")
         self.host = CONFIG.get("obs", "websocket_host", fallback="localhost")
         self.port = CONFIG.getint("obs", "websocket_port", fallback=4455)
         self.secret = SECRETS.get("obs", "websocket_secret")
         self.ws = None
 
+        ## Current scene and scene item ids are cached so a toggle is a single
+        ## request.  OBS events tell us when to throw them away.  The lock only
+        ## guards the cache, never a call, since events come in on the thread
+        ## that reads call responses.  generation goes up on every
+        ## invalidation so a lookup that raced one doesn't cache its result.
+        self.lock = RLock()
+        self.generation = 0
+        self.invalidate()
+
+    def invalidate(self, scene_uuid=None):
+        with self.lock:
+            self.generation += 1
+            if scene_uuid is None:
+                self.scene = None
+                self.scene_items = {}
+            else:
+                self.scene_items.pop(scene_uuid, None)
+
+    def invalidate_scene(self):
+        with self.lock:
+            self.generation += 1
+            self.scene = None
+
     def on_event(self, message):
         self.log.debug(f"Got message {message}")
 
+        name = getattr(message, 'name', None)
+
+        if name == "CurrentProgramSceneChanged":
+            self.invalidate_scene()
+        elif name in ("SceneItemCreated", "SceneItemRemoved"):
+            try:
+                self.invalidate(message.getSceneUuid())
+            except Exception:
+                self.invalidate()
+        elif name in ("SceneRemoved", "InputNameChanged", "InputRemoved"):
+            self.invalidate()
+
     def ensure_connected(self):
         if not self.ws:
             try:
+                self.invalidate()
                 self.ws = obsws(self.host, self.port, self.secret)
                 self.ws.connect()
                 self.ws.register(self.on_event)
@@ -36,12 +79,28 @@ class ObsApp:
             return
         self.ws.disconnect()
         self.ws = None
+        self.invalidate()
 
     def get_current_scene(self):
         if self.ws is None:
             return None
         
-        scene = self.ws.call(requests.GetCurrentProgramScene())
+        with self.lock:
+            if self.scene is not None:
+                return self.scene
+
+            generation = self.generation
+
+        result = self.ws.call(requests.GetCurrentProgramScene())
+        scene = {
+            "uuid": result.getSceneUuid(),
+            "name": result.getSceneName()
+        }
+
+        with self.lock:
+            if self.generation == generation:
+                self.scene = scene
+
         return scene
 
     def get_current_scene_uuid(self):
@@ -50,7 +109,7 @@ class ObsApp:
         if scene is None:
             return None
         
-        return scene.getSceneUuid()
+        return scene['uuid']
 
     def get_current_scene_name(self):
         scene = self.get_current_scene()
@@ -58,7 +117,7 @@ class ObsApp:
         if scene is None:
             return None
         
-        return scene.getSceneName()
+        return scene['name']
 
     def get_scene_by_name(self, scene_name):
         if self.ws is None:
@@ -77,27 +136,92 @@ class ObsApp:
         
         self.log.debug(f"Setting scene to {scene_name}")
         self.ws.call(requests.SetCurrentProgramScene(sceneName=scene_name))
+        self.invalidate_scene()
 
     def get_scene_item_by_name(self, scene_uuid, item_name):
         if self.ws is None:
             return None
         
-        items = self.ws.call(requests.GetSceneItemList(sceneUuid=scene_uuid))
-        for i in items.getSceneItems():
-            if i['sourceName'] == item_name:
-                return i['sceneItemId']
-        
-        return None
+        with self.lock:
+            if scene_uuid in self.scene_items:
+                return self.scene_items[scene_uuid].get(item_name)
+
+            generation = self.generation
+
+        result = self.ws.call(requests.GetSceneItemList(sceneUuid=scene_uuid))
+        items = { i['sourceName']: i['sceneItemId'] for i in result.getSceneItems() }
+
+        with self.lock:
+            if self.generation == generation:
+                self.scene_items[scene_uuid] = items
+
+        return items.get(item_name)
+
+    ## Show or hide a source in the current scene.  With a warm cache this is
+    ## one request.  If it fails the cache may be stale, so refresh and retry.
+    def set_source_enabled(self, source_name, enabled=True):
+        if self.ws is None:
+            return
+
+        for attempt in range(2):
+            try:
+                uuid = self.get_current_scene_uuid()
+                item_id = self.get_scene_item_by_name(uuid, source_name)
+
+                if item_id is not None:
+                    result = self.set_scene_item_enabled(uuid, item_id, enabled)
+                    if getattr(result, 'status', True):
+                        return
+            except Exception as e:
+                self.log.warning(f"Failed to set {source_name} enabled={enabled}: {e}")
+
+            self.invalidate()
+
+        self.log.error(f"Couldn't set OBS source {source_name} enabled={enabled}")
     
     def set_scene_item_enabled(self, scene_uuid, item_id, enabled=True):
         if self.ws is None:
             return None
         
-        self.ws.call(requests.SetSceneItemEnabled(sceneUuid=scene_uuid, 
-                                                  sceneItemId=item_id, 
-                                                  sceneItemEnabled=enabled))
+        result = self.ws.call(requests.SetSceneItemEnabled(sceneUuid=scene_uuid, 
+                                                           sceneItemId=item_id, 
+                                                           sceneItemEnabled=enabled))
         self.log.debug(f"Set OBS item {scene_uuid}/{item_id} enabled={enabled}")
 
+        return result
+
+    def request_step(self, request_type, **data):
+        return { "requestType": request_type, "requestData": data }
+
+    def sleep_step(self, millis):
+        return self.request_step("Sleep", sleepMillis=millis)
+
+    ## Run several requests (and Sleep steps) in order on a background thread,
+    ## so the caller never waits on a round trip or sleeps.  obsws has no
+    ## RequestBatch support, so each step is a normal call and failures are
+    ## logged.
+    def call_batch(self, steps):
+        if self.ws is None:
+            return
+
+        Thread(daemon=True, target=self.run_batch, args=(steps,)).start()
+
+    def run_batch(self, steps):
+        for step in steps:
+            if step['requestType'] == "Sleep":
+                time.sleep(step['requestData']['sleepMillis'] / 1000.0)
+                continue
+
+            try:
+                request = getattr(requests, step['requestType'])
+                result = self.ws.call(request(**step['requestData']))
+            except Exception as e:
+                self.log.warning(f"OBS {step['requestType']} failed: {e}")
+                continue
+
+            if not result.status:
+                self.log.warning(f"OBS {step['requestType']} failed: {result.datain}")
+
     def save_clip(self):
         if self.ws is None:
             return None
@@ -0,0 +1,60 @@
+from collections import OrderedDict
+
+from config import *
+from logs import *
+
+def quantize(value, step):
+    if step <= 0:
+        return value
+
+    return round(round(value / step) * step, 4)
+
+''' Least recently used cache of rendered surfaces, capped by memory use.
+
+    The avatar's head angle and scale are quantized into buckets so the same
+    poses come up again and again while talking.  Each rotated/scaled surface
+    is built once and after that drawing it is a plain blit.
+'''
+class PoseCache():
+    def __init__(self, max_bytes):
+        self.log = Logger("posecache")
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def surface_bytes(self, surface):
+        return surface.get_width() * surface.get_height() * surface.get_bytesize()
+
+    def get(self, key, build):
+        surface = self.entries.get(key)
+
+        if surface is not None:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return surface
+
+        self.misses += 1
+        surface = build()
+        self.entries[key] = surface
+        self.bytes += self.surface_bytes(surface)
+
+        # Always keep the entry we just made, even if it alone is over the cap
+        while self.bytes > self.max_bytes and len(self.entries) > 1:
+            _, evicted = self.entries.popitem(last=False)
+            self.bytes -= self.surface_bytes(evicted)
+
+        return surface
+
+    def clear(self):
+        self.entries.clear()
+        self.bytes = 0
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses
+        }
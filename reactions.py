@@ -8,6 +8,49 @@ from config import *
 from logs import *
 from obs import ObsApp
 
+''' Matches trigger phrases against text a word at a time.
+
+    Phrases are stored in a trie keyed by word, so matching costs the same no
+    matter how many phrases there are.  When several phrases match, the one
+    listed first wins, same as checking them in order.
+'''
+class PhraseMatcher():
+    def __init__(self, phrases):
+        self.root = {}
+
+        for priority, (phrase, value) in enumerate(phrases):
+            words = self.split_words(phrase)
+            if not words:
+                continue
+
+            node = self.root
+            for word in words:
+                node = node.setdefault(word, {})
+
+            # None marks the end of a phrase.  Keep the first one listed.
+            if None not in node:
+                node[None] = (priority, value)
+
+    def split_words(self, text):
+        return re.sub("[^\\w\\s]", "", text).lower().split()
+
+    def match(self, text):
+        words = self.split_words(text)
+        best = None
+
+        for start in range(len(words)):
+            node = self.root
+
+            for word in words[start:]:
+                node = node.get(word)
+                if node is None:
+                    break
+
+                if None in node and (best is None or node[None][0] < best[0]):
+                    best = node[None]
+
+        return best and best[1]
+
 class ReactionsApp():
     token = None
 
@@ -20,7 +63,18 @@ class ReactionsApp():
         self.source_path = CONFIG.get("reactions", "source_path")
         self.source_name = CONFIG.get("reactions", "source_name")
 
+        ## How a clip gets in front of OBS:
+        ##   copy    - copy the clip over source_path (the default)
+        ##   link    - atomically swap a link at source_path to point at the clip.
+        ##             Opt in, only tested on POSIX.  Windows needs symlink
+        ##             rights or both paths on one volume for a hard link.
+        ##   sources - one OBS media source per clip, named clip_source_prefix + clip
+        self.switch_mode = CONFIG.get("reactions", "switch_mode", fallback="copy")
+        self.clip_source_prefix = CONFIG.get("reactions", "clip_source_prefix", fallback="")
+        self.current_source = None
+
         self.matches = json.loads(CONFIG.get("reactions", "matches"))
+        self.matcher = PhraseMatcher(self.matches)
         self.obs = ObsApp()
 
         ## Used to disable the reaction scene item after some time has passed
@@ -33,15 +87,11 @@ class ReactionsApp():
         self.obs.shutdown()
 
     def on_voice(self, text):
-        text = re.sub("[^\\w\\s]", "", text)
-
         self.reset_reaction()
 
-        for match in self.matches:
-            pattern = f"\\b{match[0]}\\b"
-            if re.search(pattern, text, re.IGNORECASE) is not None:
-                self.play_reaction(match[1])
-                return
+        reaction = self.matcher.match(text)
+        if reaction:
+            self.play_reaction(reaction)
     
     ## Because we're not using a thread here it's a bit of a hack
     ## When speaking happens we check if we should reset and then
@@ -53,12 +103,25 @@ class ReactionsApp():
         if self.reset_reaction_on is not None:
             if time.time() > self.reset_reaction_on:
                 self.reset_reaction_on = None
-                self.toggle_reaction(toggle_to=False)
+                self.toggle_reaction(toggle_to=False, source_name=self.current_source)
 
     def play_reaction(self, reaction):
         try:
-            self.copy_reaction(reaction)
-            self.toggle_reaction()
+            if self.switch_mode == "sources":
+                source_name = f"{self.clip_source_prefix}{reaction}"
+            elif self.switch_mode == "link":
+                self.link_reaction(reaction)
+                source_name = self.source_name
+            else:
+                self.copy_reaction(reaction)
+                source_name = self.source_name
+
+            # Hide the last clip if it was playing from a different source
+            if self.current_source and self.current_source != source_name:
+                self.toggle_reaction(toggle_to=False, source_name=self.current_source)
+
+            self.toggle_reaction(source_name=source_name)
+            self.current_source = source_name
             self.reset_reaction_on = time.time() + 30
         except Exception as err:
             self.log.error(err)
@@ -68,15 +131,40 @@ class ReactionsApp():
         self.log.debug(f"Copying {clip_path} to {self.source_path}...")
         shutil.copy(clip_path, self.source_path)
 
-    def toggle_reaction(self, toggle_to=True):
+    ## Point source_path at the clip without copying it.  The link is made
+    ## beside source_path and renamed over it so OBS never sees a missing or
+    ## half written file.  Hard links are used where symlinks aren't allowed
+    ## (Windows without developer mode).
+    def link_reaction(self, reaction):
+        clip_path = os.path.abspath(os.path.join(self.clips_path, reaction) + ".mp4")
+        tmp_path = f"{self.source_path}.tmp"
+        self.log.debug(f"Linking {self.source_path} to {clip_path}...")
+
+        if os.path.lexists(tmp_path):
+            os.remove(tmp_path)
+
+        try:
+            os.symlink(clip_path, tmp_path)
+        except OSError:
+            os.link(clip_path, tmp_path)
+
+        os.replace(tmp_path, self.source_path)
+
+    def toggle_reaction(self, toggle_to=True, source_name=None):
         uuid = self.obs.get_current_scene_uuid()
-        item_id = self.obs.get_scene_item_by_name(uuid, self.source_name)
+        item_id = self.obs.get_scene_item_by_name(uuid, source_name or self.source_name)
         self.toggle_scene_item(uuid, item_id, toggle_to)
         
+    ## Hiding and re-showing the item restarts the clip.  It runs as an OBS
+    ## batch so the 250ms gap happens off the voice thread.
     def toggle_scene_item(self, uuid, item_id, toggle_to=True):
-        self.obs.set_scene_item_enabled(uuid, item_id, False)
+        steps = [
+            self.obs.request_step("SetSceneItemEnabled", sceneUuid=uuid, sceneItemId=item_id, sceneItemEnabled=False)
+        ]
         
         if toggle_to:
-            time.sleep(0.25) 
-            self.obs.set_scene_item_enabled(uuid, item_id, True)
+            steps.append(self.obs.sleep_step(250))
+            steps.append(self.obs.request_step("SetSceneItemEnabled", sceneUuid=uuid, sceneItemId=item_id, sceneItemEnabled=True))
+
+        self.obs.call_batch(steps)
 
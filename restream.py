@@ -4,6 +4,13 @@ import json
 
 import websocket
 
+# orjson is optional, it just decodes chat bursts faster
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
 from config import *
 from logs import *
 
@@ -20,22 +27,30 @@ class RestreamApp():
         self.thread = Thread(daemon=True, target=self.loop)
 
     def on_message(self, message):
-        data = json.loads(message)
+        # Only chat events are of any use, so skip heartbeats and the rest
+        # without decoding them
+        if '"event"' not in message:
+            self.log.debug("Skipping non-event frame")
+            return
+
+        data = json_loads(message)
         action = data['action']
 
-        self.log.info(action)
+        self.log.debug(action)
         if action == "event":
-            payload = data['payload']['eventPayload']
+            event = data['payload']
+            payload = event['eventPayload']
             author = payload['author']['displayName']
             text = payload['text']
 
-            m = {
+            self.log.info(f"<{author}> {text}")
+            self.on_message_cb({
                 "author": author,
                 "text": text,
-                "sent": time.time()
-            }
-            self.log.info(f"<{author}> {text}")
-            self.on_message_cb(m)
+                "sent": time.time(),
+                "id": event.get('eventIdentifier'),
+                "platform": "restream"
+            })
 
     def loop(self):
         self.log.info("Starting WS run_forever")
@@ -9,6 +9,7 @@ from rev_ai.streamingclient import RevAiStreamingClient
 
 from config import *
 from logs import *
+from tracing import TRACER
 
 class MicrophoneStream(object):
     def __init__(self, rate, chunk):
@@ -90,6 +91,7 @@ class TranscriptApp():
         self.thread = Thread(daemon=True, target=self.loop)
         self.running = False
         self.text = None
+        self.trace_id = None
         self.sendTimer = None
         self.init_corrections()
 
@@ -148,6 +150,10 @@ class TranscriptApp():
         data = json.loads(response)
             
         if data["type"] == "final":
+            # The trace starts with the first final that goes into the buffer
+            if self.trace_id is None:
+                self.trace_id = TRACER.new_trace()
+
             v = [i['value'] for i in data['elements']]
             text = ''.join(v)
 
@@ -172,9 +178,11 @@ class TranscriptApp():
 
     def send_text(self):
         self.log.info("Sending text '%s'", self.text)
-        self.on_text_cb(self.text)
+        TRACER.mark(self.trace_id, "voice.sent")
+        self.on_text_cb(self.text, self.trace_id)
         self.sendTimer = None
         self.text = None
+        self.trace_id = None
 
     def shutdown(self):
         if not self.running:
@@ -0,0 +1,108 @@
+import heapq
+import itertools
+import time
+from collections import deque
+from threading import Condition
+
+from config import *
+from logs import *
+
+''' Handle returned by Scheduler.call_later / call_every so callers can cancel '''
+class ScheduledCall():
+    def __init__(self, when, callback, interval=None):
+        self.when = when
+        self.callback = callback
+        self.interval = interval
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+''' Event driven main loop.
+
+    Callbacks are queued with call_soon (safe from any thread) or as timers
+    with call_later/call_every.  The loop sleeps until the next timer is due
+    or until another thread queues work, instead of polling at a fixed rate.
+'''
+class Scheduler():
+    def __init__(self):
+        self.log = Logger("scheduler")
+        self.ready = deque()
+        self.timers = []
+        self.counter = itertools.count()
+        self.condition = Condition()
+
+        # Upper bound on how long we block in one wait so KeyboardInterrupt is
+        # still delivered promptly on platforms where lock waits can't be
+        # interrupted.
+        self.max_sleep = CONFIG.getfloat("scheduler", "max_sleep", fallback=1.0)
+
+    def call_soon(self, callback):
+        with self.condition:
+            self.ready.append(callback)
+            self.condition.notify()
+
+    def call_later(self, delay, callback):
+        return self.schedule(ScheduledCall(time.monotonic() + delay, callback))
+
+    def call_every(self, interval, callback, delay=None):
+        if delay is None:
+            delay = interval
+
+        return self.schedule(ScheduledCall(time.monotonic() + delay, callback, interval))
+
+    def schedule(self, call):
+        with self.condition:
+            heapq.heappush(self.timers, (call.when, next(self.counter), call))
+            self.condition.notify()
+
+        return call
+
+    def wake(self):
+        with self.condition:
+            self.condition.notify()
+
+    def next_timeout(self):
+        # Drop cancelled timers off the top of the heap so they don't cause
+        # spurious wakeups
+        while self.timers and self.timers[0][2].cancelled:
+            heapq.heappop(self.timers)
+
+        if not self.timers:
+            return self.max_sleep
+
+        return max(0, min(self.timers[0][0] - time.monotonic(), self.max_sleep))
+
+    def collect_due(self):
+        now = time.monotonic()
+
+        while self.timers and self.timers[0][0] <= now:
+            _, _, call = heapq.heappop(self.timers)
+
+            if call.cancelled:
+                continue
+
+            self.ready.append(call.callback)
+
+            if call.interval is not None:
+                call.when = now + call.interval
+                heapq.heappush(self.timers, (call.when, next(self.counter), call))
+
+    def run_once(self):
+        with self.condition:
+            if not self.ready:
+                timeout = self.next_timeout()
+                if timeout > 0:
+                    self.condition.wait(timeout)
+
+            self.collect_due()
+            callbacks = list(self.ready)
+            self.ready.clear()
+
+        for callback in callbacks:
+            try:
+                callback()
+            except KeyboardInterrupt:
+                raise
+            except Exception as ex:
+                self.log.error("Exception in scheduled callback", exc_info=ex)
@@ -0,0 +1,130 @@
+import os
+import json
+import hashlib
+from collections import OrderedDict
+from threading import Lock
+
+from config import *
+from logs import *
+from synthesis import Utterance
+
+''' Synthesized speech kept on disk so repeated lines don't go back to Azure.
+
+    Lines are keyed by the voice and the text with its whitespace
+    normalized.  Each one is a .wav of the audio and a .json of its visemes.
+
+    Which lines are cached, and their sizes, are read from disk once at
+    startup and kept in least recently used order, so a lookup for a line
+    that isn't cached never touches the disk.  Reading a line touches its
+    files so the order survives a restart, and once the cache goes over
+    max_bytes the least recently used lines are deleted.
+'''
+class SpeechCache():
+    def __init__(self, path, max_bytes):
+        self.log = Logger("speechcache")
+        self.path = path
+        self.max_bytes = max_bytes
+        self.lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(path, exist_ok=True)
+        self.index = OrderedDict((key, size) for (_, key, size) in self.entries())
+        self.bytes = sum(self.index.values())
+
+    def normalize(self, text):
+        return " ".join(text.split())
+
+    def key(self, voice, text):
+        return hashlib.sha1(f"{voice}\n{self.normalize(text)}".encode("utf-8")).hexdigest()
+
+    def paths(self, key):
+        base = os.path.join(self.path, key)
+        return (f"{base}.wav", f"{base}.json")
+
+    def get(self, voice, text):
+        key = self.key(voice, text)
+        wav_path, json_path = self.paths(key)
+
+        with self.lock:
+            if key not in self.index:
+                self.misses += 1
+                return None
+
+            try:
+                with open(wav_path, "rb") as fil:
+                    audio = fil.read()
+                with open(json_path, "r") as fil:
+                    visemes = [tuple(viseme) for viseme in json.load(fil)]
+
+                os.utime(wav_path)
+                os.utime(json_path)
+            except (OSError, ValueError):
+                self.bytes -= self.index.pop(key)
+                self.misses += 1
+                return None
+
+            self.index.move_to_end(key)
+            self.hits += 1
+            return Utterance(text, audio, visemes)
+
+    def put(self, voice, text, utterance):
+        if not utterance.audio:
+            return
+
+        key = self.key(voice, text)
+        wav_path, json_path = self.paths(key)
+        visemes = json.dumps(utterance.visemes).encode("utf-8")
+
+        with self.lock:
+            self.bytes -= self.index.pop(key, 0)
+
+            try:
+                for (path, data) in [(wav_path, utterance.audio), (json_path, visemes)]:
+                    with open(f"{path}.tmp", "wb") as fil:
+                        fil.write(data)
+                    os.replace(f"{path}.tmp", path)
+            except OSError as e:
+                self.log.warning(f"Failed to cache speech for {text}: {e}")
+                self.remove(key)
+                return
+
+            self.index[key] = len(utterance.audio) + len(visemes)
+            self.bytes += self.index[key]
+
+            if self.bytes > self.max_bytes:
+                self.evict()
+
+    ## (last used, key, size) of every cached line on disk, oldest first
+    def entries(self):
+        entries = {}
+        for name in os.listdir(self.path):
+            key, ext = os.path.splitext(name)
+            if ext in (".wav", ".json"):
+                stat = os.stat(os.path.join(self.path, name))
+                mtime, size = entries.get(key, (0, 0))
+                entries[key] = (max(mtime, stat.st_mtime), size + stat.st_size)
+
+        return sorted((mtime, key, size) for key, (mtime, size) in entries.items())
+
+    def evict(self):
+        while self.index and self.bytes > self.max_bytes:
+            key, size = self.index.popitem(last=False)
+            self.remove(key)
+            self.bytes -= size
+
+        self.log.debug(f"Evicted speech down to {self.bytes} bytes")
+
+    def remove(self, key):
+        for path in self.paths(key):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        return {
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses
+        }
@@ -0,0 +1,328 @@
+import time
+from collections import deque, OrderedDict
+from itertools import count
+from threading import Condition
+
+from config import *
+from logs import *
+
+## Lower is more urgent.  Keyed by reply context type.
+PRIORITIES = {
+    "command": 0,
+    "history": 0,
+    "activation": 1,
+    "code": 1,
+    "discussion": 2,
+    "spam": 2,
+    "boredom": 3
+}
+
+def priority_for(kind):
+    return PRIORITIES.get(kind, PRIORITIES['discussion'])
+
+''' Queue of lines waiting to be spoken.
+
+    Items are dicts with at least a "text", and a "priority" from
+    PRIORITIES.  More urgent lines are spoken first, in the order they came
+    in within the same priority.
+
+    Replies are streamed a sentence at a time, so lines with the same
+    "trace" belong to one reply and the limits apply to whole replies.
+    Lines without a trace are a reply on their own.  Once maxsize replies
+    are waiting the policy decides what gives:
+
+        drop_oldest - the oldest of the least urgent replies is dropped
+        drop_newest - the newest of the least urgent replies is dropped
+        coalesce    - the new reply's text is merged onto the end of the
+                      last waiting one with the same priority
+
+    Only replies that haven't started being spoken can be dropped to make
+    room, and nothing is dropped for a reply less urgent than everything
+    waiting, the new reply is dropped instead.  Once a reply is dropped, the
+    rest of its lines are dropped as they come in.
+
+    Lines at preempt_priority or more urgent preempt: every less urgent
+    reply still waiting is dropped, and preempts() tells the speaker to cut
+    off the line it's saying.
+
+    Replies that have waited longer than max_latency seconds to start are
+    dropped rather than spoken late.  A maxsize or max_latency of 0 means
+    no limit.
+
+    on_drop is called with each queued item that's dropped, or replaced by
+    a merged one, so anything started for it (like synthesis) can be
+    cancelled.
+'''
+class SpeechQueue():
+    policies = ("drop_oldest", "drop_newest", "coalesce")
+
+    def __init__(self, maxsize=0, policy="drop_oldest", max_latency=0, preempt_priority=None, max_replies=1000,
+                 on_drop=None):
+        self.log = Logger("speechqueue")
+        self.on_drop = on_drop
+        self.maxsize = maxsize
+        self.max_latency = max_latency
+        self.preempt_priority = preempt_priority
+        self.max_replies = max_replies
+        self.items = deque()
+        self.replies = OrderedDict()
+        self.speaking = None
+        self.ids = count()
+        self.condition = Condition()
+        self.dropped = 0
+        self.coalesced = 0
+        self.expired = 0
+        self.preempted = 0
+
+        if policy not in self.policies:
+            self.log.error(f"Unknown queue policy {policy}, using drop_oldest")
+            policy = "drop_oldest"
+
+        self.policy = policy
+
+    ## Build a queue from a config section's queue_size, queue_policy,
+    ## max_latency and preempt_priority
+    @classmethod
+    def from_config(cls, section):
+        preempt_priority = CONFIG.get(section, "preempt_priority", fallback="")
+
+        return cls(CONFIG.getint(section, "queue_size", fallback=0),
+                   CONFIG.get(section, "queue_policy", fallback="drop_oldest"),
+                   CONFIG.getfloat(section, "max_latency", fallback=0),
+                   int(preempt_priority) if preempt_priority else None)
+
+    def __len__(self):
+        with self.condition:
+            return len(self.items)
+
+    ## Returns the queued item, or None if it (or the rest of its reply) was
+    ## dropped
+    def put(self, item):
+        item.setdefault("queued", time.time())
+        item.setdefault("priority", PRIORITIES['discussion'])
+
+        with self.condition:
+            self.expire()
+
+            key = item.get('trace') or f"line-{next(self.ids)}"
+            reply = self.reply_for(key)
+            state = self.replies.get(reply)
+
+            if state and state['dropped']:
+                self.log.info(f"Dropping {item['text']}, the rest of its reply was dropped")
+                return None
+
+            stale = [queued for queued in self.waiting() if self.preempts(item['priority'], self.replies[queued]['priority'])]
+            for queued in stale:
+                self.preempted += 1
+                self.drop_reply(queued, "for something more important")
+
+            if state is None:
+                if self.maxsize and len(self.waiting()) >= self.maxsize:
+                    reply = self.make_room(item, key)
+                    if reply is None:
+                        return None
+
+                state = self.replies.get(reply) or self.track(reply, item)
+
+            item['reply'] = reply
+            item['part'] = int(reply != key)
+            merged = item['part'] and self.merge(item)
+            if merged:
+                item = merged
+            else:
+                self.insert(item, state)
+
+            self.condition.notify()
+
+            return item
+
+    ## Whether a line at priority should cut off one at other
+    def preempts(self, priority, other):
+        return (self.preempt_priority is not None and
+                priority <= self.preempt_priority and
+                priority < other)
+
+    ## The reply a line belongs to, following any it was coalesced into
+    def reply_for(self, reply):
+        while reply in self.replies and self.replies[reply].get('into'):
+            reply = self.replies[reply]['into']
+
+        return reply
+
+    ## Coalesced lines are merged into one line, said after the rest of the
+    ## reply they joined.  None if that line isn't waiting to add to.
+    def merge(self, item):
+        lines = [queued for queued in self.items if queued['reply'] == item['reply'] and queued['part']]
+        if not lines:
+            return None
+
+        last = lines[-1]
+        merged = dict(last, text=f"{last['text']} {item['text']}")
+        merged.pop('speech', None)
+
+        for (i, queued) in enumerate(self.items):
+            if queued is last:
+                self.items[i] = merged
+
+        if self.on_drop:
+            self.on_drop(last)
+
+        return merged
+
+    def track(self, reply, item):
+        state = {
+            "priority": item['priority'],
+            "queued": item['queued'],
+            "order": next(self.ids),
+            "started": False,
+            "dropped": False
+        }
+
+        self.replies[reply] = state
+        self.forget(reply)
+
+        return state
+
+    ## Forget the oldest replies past max_replies, as long as nothing of
+    ## theirs is queued or being spoken
+    def forget(self, keep):
+        if len(self.replies) <= self.max_replies:
+            return
+
+        active = set(self.waiting()) | { keep, self.speaking }
+        stale = [reply for (reply, state) in self.replies.items()
+                 if reply not in active and state.get('into', reply) not in active]
+
+        for reply in stale[:len(self.replies) - self.max_replies]:
+            del self.replies[reply]
+
+    ## Replies with lines still in the queue, in the order they're queued
+    def waiting(self):
+        return list(OrderedDict.fromkeys(queued['reply'] for queued in self.items))
+
+    ## Returns the reply to queue the item under, or None if it's the one
+    ## that had to go
+    def make_room(self, item, reply):
+        candidates = [queued for queued in self.waiting() if not self.replies[queued]['started']]
+        same = [queued for queued in candidates if self.replies[queued]['priority'] == item['priority']]
+
+        if self.policy == "coalesce" and same:
+            self.replies[reply] = { "into": same[-1] }
+            self.coalesced += 1
+            return same[-1]
+
+        least = max([self.replies[queued]['priority'] for queued in candidates], default=None)
+        if (least is None or item['priority'] > least or
+                (item['priority'] == least and self.policy == "drop_newest")):
+            self.track(reply, item)['dropped'] = True
+            self.dropped += 1
+            self.log.info(f"Queue full, dropping {item['text']}")
+            return None
+
+        victims = [queued for queued in candidates if self.replies[queued]['priority'] == least]
+        self.dropped += 1
+        self.drop_reply(victims[-1] if self.policy == "drop_newest" else victims[0], "to make room")
+
+        return reply
+
+    ## Take every line of a reply out of the queue, and keep the rest of it
+    ## from being queued
+    def drop_reply(self, reply, reason):
+        self.replies[reply]['dropped'] = True
+
+        for dropped in [queued for queued in self.items if queued['reply'] == reply]:
+            self.remove(dropped)
+            self.log.info(f"Dropping {dropped['text']} {reason}")
+
+            if self.on_drop:
+                self.on_drop(dropped)
+
+    ## Goes after everything at the same or a more urgent priority, keeping
+    ## each reply's lines together
+    def insert(self, item, state):
+        rank = (state['priority'], state['order'], item['part'])
+
+        for (i, queued) in enumerate(self.items):
+            other = self.replies[queued['reply']]
+            if (other['priority'], other['order'], queued['part']) > rank:
+                self.items.insert(i, item)
+                return
+
+        self.items.append(item)
+
+    def remove(self, item):
+        for (i, queued) in enumerate(self.items):
+            if queued is item:
+                del self.items[i]
+                return True
+
+        return False
+
+    def started(self, item):
+        self.speaking = item['reply']
+        state = self.replies.get(item['reply'])
+        if state:
+            state['started'] = True
+
+        return item
+
+    ## Wait for the next item.  Returns None on timeout, or straight away
+    ## when not blocking and the queue is empty.
+    def get(self, block=True, timeout=None):
+        with self.condition:
+            while True:
+                self.expire()
+
+                if self.items:
+                    return self.started(self.items.popleft())
+
+                if not block or not self.condition.wait(timeout):
+                    return None
+
+    def peek(self):
+        with self.condition:
+            self.expire()
+            return self.items[0] if self.items else None
+
+    ## Take an item out of the queue to speak it.  False if it was already
+    ## gone.
+    def discard(self, item):
+        with self.condition:
+            if not self.remove(item):
+                return False
+
+            self.started(item)
+            return True
+
+    def snapshot(self):
+        with self.condition:
+            self.expire()
+            return list(self.items)
+
+    def clear(self):
+        with self.condition:
+            for reply in self.waiting():
+                self.drop_reply(reply, "while clearing the queue")
+
+    ## Replies that haven't started within max_latency are dropped whole
+    def expire(self):
+        if not self.max_latency:
+            return
+
+        cutoff = time.time() - self.max_latency
+        for reply in self.waiting():
+            state = self.replies[reply]
+            if not state['started'] and state['queued'] < cutoff:
+                self.expired += 1
+                self.drop_reply(reply, "after waiting too long to say it")
+
+    def stats(self):
+        with self.condition:
+            return {
+                "queued": len(self.items),
+                "dropped": self.dropped,
+                "coalesced": self.coalesced,
+                "expired": self.expired,
+                "preempted": self.preempted
+            }
@@ -6,6 +6,7 @@ from oauth import OAuthApp
 
 from config import *
 from logs import *
+from tracing import TRACER
 
 class StreamerApp():
     token = None
@@ -13,14 +14,14 @@ class StreamerApp():
     def __init__(self, on_say, on_voice):
         self.log = Logger("streamer")
         self.rev = TranscriptApp(
-            on_text=lambda t : self.on_text(t),
+            on_text=lambda t, trace=None : self.on_text(t, trace),
             on_voice=on_voice
         )
         self.name = CONFIG.get("streamer", "name")
 
         if CONFIG.getboolean("streamer", "send_to_twitch", fallback=True):
             self.oauth = OAuthApp(CONFIG.get("streamer", "twitch_oauth_section"))
-            self.twitch = TwitchApp(self.name, self.name)
+            self.twitch = TwitchApp(self.name, self.name, trace_stage="twitch.relayed")
         else:
             self.oauth = None
             self.twitch = None
@@ -48,16 +49,19 @@ class StreamerApp():
             self.oauth.shutdown()
 
 
-    def on_text(self, text):
+    def on_text(self, text, trace=None):
         # If we're sending to twitch, we don't need to call on_say since the
-        # message will come back through restream
+        # message will come back through restream.  The trace is picked back
+        # up from the text when it does.
         if self.twitch:
-            self.twitch.say(text)
+            TRACER.link_text(text, trace)
+            self.twitch.say(text, trace)
         else:
             msg = {
                 "author": self.name,
                 "text": text,
-                "sent": time.time()
+                "sent": time.time(),
+                "trace": trace
             }
             self.on_say(msg)
     
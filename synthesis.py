@@ -0,0 +1,57 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import azure.cognitiveservices.speech as speechsdk
+
+from config import *
+from logs import *
+
+''' Synthesized speech for one line: WAV bytes plus (seconds, viseme id) pairs '''
+class Utterance():
+    def __init__(self, text, audio=None, visemes=None):
+        self.text = text
+        self.audio = audio
+        self.visemes = visemes or []
+
+''' Synthesizes lines ahead of time without playing them.
+
+    Lines are synthesized one at a time in the order they're submitted, on a
+    background thread, while earlier lines are still being spoken.  The
+    result is a WAV file in memory and the visemes that go with it, ready to
+    be played back locally the moment the line before it finishes.
+'''
+class PreSynthesizer():
+    def __init__(self, speech_key, speech_region, voice):
+        self.log = Logger("synthesis")
+
+        speech_config = speechsdk.SpeechConfig(subscription=speech_key, region=speech_region)
+        speech_config.speech_synthesis_voice_name = voice
+        speech_config.set_speech_synthesis_output_format(
+            speechsdk.SpeechSynthesisOutputFormat.Riff24Khz16BitMonoPcm)
+
+        # No audio config, so the audio only comes back in the result
+        self.tts = speechsdk.SpeechSynthesizer(speech_config=speech_config, audio_config=None)
+        self.tts.viseme_received.connect(self.on_viseme)
+
+        self.visemes = []
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="synthesis")
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    ## audio_offset is in 100ns ticks
+    def on_viseme(self, evt):
+        self.visemes.append((evt.audio_offset / 10000000, evt.viseme_id))
+
+    def submit(self, text):
+        return self.executor.submit(self.synthesize, text)
+
+    def synthesize(self, text):
+        self.visemes = []
+        result = self.tts.speak_text_async(text).get()
+
+        if result.reason != speechsdk.ResultReason.SynthesizingAudioCompleted:
+            self.log.error(f"Failed to synthesize {text}: {result.reason}")
+            return Utterance(text)
+
+        self.log.debug(f"Synthesized {len(result.audio_data)} bytes, {len(self.visemes)} visemes for {text}")
+        return Utterance(text, result.audio_data, self.visemes)
@@ -0,0 +1,62 @@
+import time
+
+from dedup import DedupCache
+
+def message(text, platform="twitch", id=None, author="viewer"):
+    return { "author": author, "text": text, "platform": platform, "id": id }
+
+def test_redelivered_id():
+    cache = DedupCache()
+
+    assert not cache.is_duplicate(message("hi", "restream", id="1"))
+    assert cache.is_duplicate(message("hi", "restream", id="1"))
+    assert cache.stats()['suppressed_by_id'] == 1
+
+    ## The same id from another platform is a different message
+    assert not cache.is_duplicate(message("hello", "twitch", id="1"))
+
+def test_same_message_from_two_places():
+    cache = DedupCache()
+
+    assert not cache.is_duplicate(message("hi", "twitch", id="t1"))
+    assert cache.is_duplicate(message("hi", "restream", id="r1"))
+    assert cache.stats()['suppressed_by_content'] == 1
+
+    ## A redelivery of the suppressed copy is still caught by its id
+    assert cache.is_duplicate(message("hi", "restream", id="r1"))
+
+def test_genuine_repeats_are_kept():
+    cache = DedupCache()
+
+    ## Saying the same thing twice on one platform
+    assert not cache.is_duplicate(message("lol", "twitch", id="1"))
+    assert not cache.is_duplicate(message("lol", "twitch", id="2"))
+
+    ## Each copy from the other platform uses up one of them
+    assert cache.is_duplicate(message("lol", "restream", id="a"))
+    assert cache.is_duplicate(message("lol", "restream", id="b"))
+
+    ## and a third copy is new
+    assert not cache.is_duplicate(message("lol", "restream", id="c"))
+    assert cache.is_duplicate(message("lol", "twitch", id="3"))
+
+    ## Different authors saying the same thing
+    assert not cache.is_duplicate(message("gg", "twitch", author="one"))
+    assert not cache.is_duplicate(message("gg", "restream", author="two"))
+
+def test_window():
+    cache = DedupCache(window=0.05)
+
+    assert not cache.is_duplicate(message("hi", "restream", id="1"))
+    time.sleep(0.1)
+    assert not cache.is_duplicate(message("hi", "restream", id="1"))
+
+def test_max_entries():
+    cache = DedupCache(max_entries=4)
+
+    for i in range(3):
+        assert not cache.is_duplicate(message(f"message {i}", "restream", id=str(i)))
+
+    ## The oldest message's keys have been pushed out
+    assert len(cache.entries) == 4
+    assert not cache.is_duplicate(message("message 0", "restream", id="0"))
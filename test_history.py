@@ -0,0 +1,77 @@
+import os
+import json
+import tempfile
+
+from history import HistoryLog
+
+def message(i):
+    return { "author": "tester", "text": f"message {i}", "sent": i }
+
+def test_replays_journal_after_crash():
+    path = os.path.join(tempfile.mkdtemp(), "history.json")
+
+    ## Appends go to the journal until compact_every is reached
+    history = HistoryLog(path, 10, compact_every=5)
+    for i in range(3):
+        history.append(message(i))
+
+    ## Without close(), as if we crashed
+    replayed = HistoryLog(path, 10, compact_every=5)
+    assert replayed.snapshot() == [message(i) for i in range(3)]
+
+def test_skips_torn_journal_line():
+    path = os.path.join(tempfile.mkdtemp(), "history.json")
+
+    history = HistoryLog(path, 10, compact_every=5)
+    history.append(message(0))
+    history.journal.write('{"author": "tester", "te')
+    history.journal.flush()
+
+    assert HistoryLog(path, 10).snapshot() == [message(0)]
+
+def test_crash_before_journal_truncated():
+    path = os.path.join(tempfile.mkdtemp(), "history.json")
+
+    history = HistoryLog(path, 10, compact_every=5)
+    for i in range(3):
+        history.append(message(i))
+
+    ## The snapshot is written, but we crash before the journal is emptied
+    with open(f"{path}.journal") as fil:
+        journal = fil.read()
+    history.compact()
+    with open(f"{path}.journal", "w") as fil:
+        fil.write(journal)
+
+    history = HistoryLog(path, 10, compact_every=5)
+    assert history.snapshot() == [message(i) for i in range(3)]
+
+    ## and numbering carries on from where it was
+    history.append(message(3))
+    assert HistoryLog(path, 10).snapshot() == [message(i) for i in range(4)]
+
+def test_loads_old_snapshot():
+    path = os.path.join(tempfile.mkdtemp(), "history.json")
+    with open(path, "w") as fil:
+        json.dump([message(0)], fil)
+
+    history = HistoryLog(path, 10)
+    history.append(message(1))
+    assert HistoryLog(path, 10).snapshot() == [message(0), message(1)]
+
+def test_compacts_into_snapshot():
+    path = os.path.join(tempfile.mkdtemp(), "history.json")
+
+    history = HistoryLog(path, 3, compact_every=4)
+    for i in range(4):
+        history.append(message(i))
+
+    ## The snapshot only keeps the last size messages, and the journal starts over
+    with open(path) as fil:
+        assert json.load(fil)['messages'] == [message(i) for i in range(1, 4)]
+    assert os.path.getsize(f"{path}.journal") == 0
+
+    history.append(message(4))
+    history.close()
+
+    assert HistoryLog(path, 3).snapshot() == [message(i) for i in range(2, 5)]
@@ -0,0 +1,35 @@
+import pytest
+
+pytest.importorskip("websocket")
+pytest.importorskip("requests")
+
+from twitch import TwitchApp
+
+tests = [
+    ## Short lines are joined
+    (["one", "two", "three"], ["one two three"]),
+
+    ## Until the next one won't fit
+    (["aaaaaaaaaa", "bbbbbbbbb", "cccc"], ["aaaaaaaaaa bbbbbbbbb", "cccc"]),
+
+    ## Long lines are split between words
+    (["the quick brown fox jumps over"], ["the quick brown fox", "jumps over"]),
+
+    ## A word longer than a message is cut
+    (["x" * 45], ["x" * 20, "x" * 20, "x" * 5]),
+
+    ## Chat commands always go on their own
+    (["hello", "/pin hello", "there"], ["hello", "/pin hello", "there"]),
+
+    ## Blank lines and extra whitespace go away
+    (["", "  spaced   out  ", "   "], ["spaced out"]),
+]
+
+def test_pack_lines():
+    twitch = TwitchApp("tester", "tester", read_only=True)
+    twitch.max_message_length = 20
+
+    for (lines, expected) in tests:
+        packed = twitch.pack_lines(lines)
+        assert packed == expected, lines
+        assert all(len(message) <= 20 for message in packed)
@@ -0,0 +1,41 @@
+import pytest
+
+pytest.importorskip("obswebsocket")
+
+from reactions import PhraseMatcher
+
+phrases = [
+    ["oh no", "oh-no.mp4"],
+    ["no way", "no-way.mp4"],
+    ["oh no no no", "oh-no-no-no.mp4"],
+    ["way", "way.mp4"],
+    ["OH NO", "duplicate.mp4"],
+    ["!!!", "empty.mp4"],
+]
+
+tests = [
+    ## Matches ignore case and punctuation
+    ("Oh, NO!", "oh-no.mp4"),
+
+    ## Anywhere in the text
+    ("well oh no that's bad", "oh-no.mp4"),
+
+    ## The phrase listed first wins, even when a later one is longer
+    ("oh no no no", "oh-no.mp4"),
+
+    ## Or when a later one matches earlier in the text
+    ("way no way", "no-way.mp4"),
+
+    ## Whole words only
+    ("ohno", None),
+    ("nowhere", None),
+
+    ## Nothing to match
+    ("", None),
+]
+
+def test_match():
+    matcher = PhraseMatcher(phrases)
+
+    for (text, expected) in tests:
+        assert matcher.match(text) == expected, text
@@ -0,0 +1,161 @@
+import time
+
+from speechqueue import SpeechQueue
+
+def line(text, trace=None, priority=2):
+    return { "text": text, "trace": trace, "priority": priority }
+
+def texts(queue):
+    return [item['text'] for item in queue.snapshot()]
+
+def test_priority_order():
+    queue = SpeechQueue()
+    queue.put(line("later", priority=3))
+    queue.put(line("first", priority=0))
+    queue.put(line("second", priority=2))
+    queue.put(line("third", priority=2))
+
+    assert texts(queue) == ["first", "second", "third", "later"]
+
+def test_reply_lines_stay_together():
+    queue = SpeechQueue()
+    queue.put(line("a1", "a"))
+    queue.put(line("b1", "b"))
+    queue.put(line("a2", "a"))
+
+    assert texts(queue) == ["a1", "a2", "b1"]
+
+def test_limit_counts_replies():
+    queue = SpeechQueue(maxsize=1, policy="drop_newest")
+
+    ## Every sentence of the reply fits, however many there are
+    for i in range(5):
+        assert queue.put(line(f"a{i}", "a"))
+
+    assert queue.put(line("b1", "b")) is None
+    assert len(queue) == 5
+
+def test_drop_oldest():
+    queue = SpeechQueue(maxsize=2, policy="drop_oldest")
+    queue.put(line("a1", "a"))
+    queue.put(line("b1", "b"))
+    queue.put(line("a2", "a"))
+    queue.put(line("c1", "c"))
+
+    ## The whole oldest reply goes, and the rest of it doesn't come back
+    assert texts(queue) == ["b1", "c1"]
+    assert queue.put(line("a3", "a")) is None
+    assert queue.stats()['dropped'] == 1
+
+def test_drop_newest():
+    queue = SpeechQueue(maxsize=2, policy="drop_newest")
+    queue.put(line("a1", "a"))
+    queue.put(line("b1", "b"))
+
+    assert queue.put(line("c1", "c")) is None
+    assert queue.put(line("c2", "c")) is None
+
+    ## Unless the new reply is more urgent
+    queue.put(line("d1", "d", priority=1))
+    assert texts(queue) == ["d1", "a1"]
+
+def test_less_urgent_reply_is_dropped():
+    queue = SpeechQueue(maxsize=1, policy="drop_oldest")
+    queue.put(line("a1", "a", priority=1))
+
+    assert queue.put(line("b1", "b", priority=3)) is None
+    assert texts(queue) == ["a1"]
+
+def test_started_reply_is_never_dropped():
+    queue = SpeechQueue(maxsize=1, policy="drop_oldest")
+    queue.put(line("a1", "a"))
+    queue.put(line("a2", "a"))
+    queue.get()
+
+    ## a has started, so b has nothing to push out
+    assert queue.put(line("b1", "b")) is None
+
+    ## and the rest of a still comes in after everything it had is spoken
+    queue.get()
+    assert queue.put(line("a3", "a"))
+    assert texts(queue) == ["a3"]
+
+def test_coalesce():
+    dropped = []
+    queue = SpeechQueue(maxsize=1, policy="coalesce", on_drop=dropped.append)
+    queue.put(line("a1", "a"))
+    queue.put(line("b1", "b"))
+    queue.put(line("a2", "a"))
+    queue.put(line("c1", "c"))
+    queue.put(line("b2", "b"))
+
+    ## b and c are said after all of a
+    assert texts(queue) == ["a1", "a2", "b1 c1 b2"]
+    assert [item['text'] for item in dropped] == ["b1", "b1 c1"]
+    assert queue.stats()['coalesced'] == 2
+
+def test_coalesce_keeps_to_maxsize():
+    queue = SpeechQueue(maxsize=2, policy="coalesce")
+    for i in range(50):
+        queue.put(line(f"reply {i}", f"r{i}"))
+
+    ## Two replies, the second with everything after it merged into one line
+    assert len(queue.waiting()) == 2
+    assert texts(queue) == ["reply 0", "reply 1", " ".join(f"reply {i}" for i in range(2, 50))]
+    assert queue.stats()['coalesced'] == 48
+
+def test_untraced_lines_are_replies_of_their_own():
+    queue = SpeechQueue(maxsize=1, policy="drop_oldest")
+    queue.put(line("one"))
+    queue.put(line("two"))
+
+    assert texts(queue) == ["two"]
+
+def test_old_replies_are_forgotten_once_done():
+    queue = SpeechQueue(max_replies=3)
+    queue.put(line("a1", "a"))
+    for reply in "bcdef":
+        queue.put(line(f"{reply}1", reply))
+
+    ## a is still waiting, so it's remembered and its lines stay together
+    queue.put(line("a2", "a"))
+    assert texts(queue) == ["a1", "a2", "b1", "c1", "d1", "e1", "f1"]
+
+    ## Once it's spoken, it can be forgotten
+    for i in range(7):
+        queue.get()
+    queue.put(line("g1", "g"))
+    queue.put(line("h1", "h"))
+    assert "a" not in queue.replies
+
+def test_preempt():
+    dropped = []
+    queue = SpeechQueue(preempt_priority=0, on_drop=dropped.append)
+    queue.put(line("a1", "a", priority=2))
+    queue.put(line("b1", "b", priority=0))
+    queue.put(line("c1", "c", priority=0))
+
+    assert texts(queue) == ["b1", "c1"]
+    assert [item['text'] for item in dropped] == ["a1"]
+    assert queue.preempts(0, 2)
+    assert not queue.preempts(0, 0)
+    assert not queue.preempts(1, 2)
+    assert queue.put(line("a2", "a", priority=2)) is None
+
+def test_expire_whole_replies():
+    dropped = []
+    queue = SpeechQueue(max_latency=30, on_drop=dropped.append)
+    queue.put(line("a1", "a"))
+    queue.put(line("a2", "a"))
+    queue.get()
+
+    ## a started being spoken in time, so the rest of it is kept
+    queue.replies['a']['queued'] = time.time() - 60
+
+    ## Waiting is counted from the reply's first line
+    queue.put(dict(line("b1", "b"), queued=time.time() - 60))
+    assert queue.put(line("b2", "b")) is None
+
+    assert texts(queue) == ["a2"]
+    assert [item['text'] for item in dropped] == ["b1"]
+    assert queue.stats()['expired'] == 1
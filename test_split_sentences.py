@@ -0,0 +1,54 @@
+import pytest
+
+pytest.importorskip("openai")
+
+from chatgpt import CompletionApp
+
+tests = [
+    ## Sentences are split on their ending punctuation
+    ("That is great to hear. What are you playing today?",
+     ["That is great to hear.", "What are you playing today?"]),
+
+    ## Trailing emoji stay with their sentence
+    ("That is great to hear! 😂 What are you playing?",
+     ["That is great to hear! 😂", "What are you playing?"]),
+
+    ## And on new lines
+    ("Here is the first line\nAnd here is the second",
+     ["Here is the first line", "And here is the second"]),
+
+    ## Abbreviations don't end a sentence
+    ("Try a loop, e.g. this one. Mr. Potato says hi to you.",
+     ["Try a loop, e.g. this one.", "Mr. Potato says hi to you."]),
+
+    ## Neither do list numbers and initials
+    ("Steps to follow:\n1. Open the door. 2. Walk through it. J. R. R. Tolkien wrote it.",
+     ["Steps to follow:", "1. Open the door.", "2. Walk through it.", "J. R. R. Tolkien wrote it."]),
+
+    ## "No." only when a number follows
+    ("Oh no. That is really bad news. Number No. 5 is alive.",
+     ["Oh no. That is really bad news.", "Number No. 5 is alive."]),
+    ("That is bad, oh no. That is really bad news.",
+     ["That is bad, oh no.", "That is really bad news."]),
+
+    ## I is a word, not an initial
+    ("Yes I think so, I can. Sorry about that.",
+     ["Yes I think so, I can.", "Sorry about that."]),
+
+    ## Short fragments are kept with the next sentence
+    ("Sure! Here is what I think about it.",
+     ["Sure! Here is what I think about it."]),
+
+    ## Code blocks are kept in one piece, along with what's waiting before them
+    ("Look at this code. ```python\nprint('Hi. There.')\n```",
+     ["Look at this code. ```python\nprint('Hi. There.')\n```"]),
+]
+
+def test_split_sentences():
+    completion = CompletionApp()
+    completion.min_sentence_length = 12
+
+    for (text, expected) in tests:
+        ## Whether it comes in as one token or a character at a time
+        assert list(completion.split_sentences([text])) == expected, text
+        assert list(completion.split_sentences(list(text))) == expected, text
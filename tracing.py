@@ -0,0 +1,134 @@
+import os
+import json
+import time
+import uuid
+from collections import OrderedDict, deque
+from threading import Lock
+
+from config import *
+from logs import *
+
+''' A timed piece of work within a trace.  end() records how long it took. '''
+class Span():
+    def __init__(self, tracer, trace_id, name):
+        self.tracer = tracer
+        self.trace_id = trace_id
+        self.name = name
+        self.start = time.time()
+
+    def end(self):
+        self.tracer.record(self.name, time.time() - self.start)
+
+''' Latency tracing for the voice -> reply -> speech pipeline.
+
+    A trace id is made when something enters the pipeline (a final
+    transcript, or a chat message) and is passed along with the message and
+    reply context.  Each stage calls mark() with the trace id, which records
+    how long after the start of the trace it first got there, and span()
+    times a single piece of work on its own.  Later marks of a stage in the
+    same trace (the rest of a reply's sentences) are ignored.
+
+    Text the streamer says is sent to Twitch and comes back as a chat
+    message, so link_text() remembers the trace for a line of text and
+    trace_for_text() picks it up again when it comes back.
+
+    The last `samples` timings of each stage are kept for percentiles, and
+    written to export_path every export_interval seconds.
+'''
+class Tracer():
+    def __init__(self, samples=1000, export_path=None, export_interval=10.0, max_traces=1000):
+        self.log = Logger("tracing")
+        self.samples = samples
+        self.export_path = export_path
+        self.export_interval = export_interval
+        self.max_traces = max_traces
+        self.lock = Lock()
+        self.traces = OrderedDict()
+        self.texts = OrderedDict()
+        self.timings = {}
+        self.last_export = time.time()
+
+    def new_trace(self):
+        trace_id = uuid.uuid4().hex[:12]
+
+        with self.lock:
+            self.traces[trace_id] = (time.time(), set())
+            while len(self.traces) > self.max_traces:
+                self.traces.popitem(last=False)
+
+        return trace_id
+
+    def span(self, trace_id, name):
+        return Span(self, trace_id, name)
+
+    ## Record the time since the trace started as the latency to reach stage,
+    ## the first time it does
+    def mark(self, trace_id, stage):
+        with self.lock:
+            start, marked = self.traces.get(trace_id, (None, None))
+            if start is None or stage in marked:
+                return
+
+            marked.add(stage)
+
+        elapsed = time.time() - start
+        self.log.debug(f"[{trace_id}] {stage} at {elapsed * 1000:.1f}ms")
+        self.record(stage, elapsed)
+
+    def record(self, name, seconds):
+        with self.lock:
+            if name not in self.timings:
+                self.timings[name] = deque(maxlen=self.samples)
+
+            self.timings[name].append(seconds)
+
+            export = self.export_path and time.time() - self.last_export > self.export_interval
+            if export:
+                self.last_export = time.time()
+
+        if export:
+            self.export()
+
+    def link_text(self, text, trace_id):
+        if not trace_id:
+            return
+
+        with self.lock:
+            self.texts[text.strip()] = trace_id
+            while len(self.texts) > self.max_traces:
+                self.texts.popitem(last=False)
+
+    def trace_for_text(self, text):
+        with self.lock:
+            return self.texts.pop(text.strip(), None)
+
+    def percentile(self, timings, fraction):
+        return timings[min(len(timings) - 1, int(len(timings) * fraction))]
+
+    def stats(self):
+        with self.lock:
+            timings = { name: sorted(values) for name, values in self.timings.items() }
+
+        return {
+            name: {
+                "count": len(values),
+                "mean_ms": round(sum(values) / len(values) * 1000, 1),
+                "p50_ms": round(self.percentile(values, 0.5) * 1000, 1),
+                "p99_ms": round(self.percentile(values, 0.99) * 1000, 1),
+                "max_ms": round(values[-1] * 1000, 1)
+            }
+            for name, values in timings.items() if values
+        }
+
+    def export(self):
+        try:
+            tmp_path = f"{self.export_path}.tmp"
+            with open(tmp_path, "w") as fil:
+                json.dump(self.stats(), fil, indent=2)
+            os.replace(tmp_path, self.export_path)
+        except Exception as e:
+            self.log.warning(f"Failed to export latency stats to {self.export_path}: {e}")
+
+TRACER = Tracer(CONFIG.getint("tracing", "samples", fallback=1000),
+                CONFIG.get("tracing", "export_path", fallback=None),
+                CONFIG.getfloat("tracing", "export_interval", fallback=10.0))
@@ -5,16 +5,19 @@ import pyttsx3
 
 from config import *
 from logs import *
+from speechqueue import SpeechQueue, PRIORITIES
+from tracing import TRACER
 
 ''' TTS App for talking '''
 class TTSApp():
     thread = None
     running = False
-    queue = []
     last_completion = None
+    speaking_priority = None
 
     def __init__(self):
         self.log = Logger(f"TTS")
+        self.queue = SpeechQueue.from_config("speech")
         
         self.thread = Thread(daemon=True, target=self.loop)
 
@@ -23,18 +26,19 @@ class TTSApp():
         self.running = True
         self.thread.start()
 
-    def say(self, text):
+    def say(self, text, priority=PRIORITIES['discussion'], trace=None, stock=False):
         self.log.info(f"Appending {text}")
-        self.queue.append(text)
+        self.queue.put({ "text": text, "priority": priority, "trace": trace })
+
+        speaking_priority = self.speaking_priority
+        if speaking_priority is not None and self.queue.preempts(priority, speaking_priority):
+            self.log.info("Cutting off the current line for something more important")
+            self.tts.stop()
 
     def ack(self):
         ## TODO Play a wav file
         pass
 
-    def tick(self):
-        # Used in Avatar to run on the main loop.
-        pass
-
     def loop(self):
         self.tts = pyttsx3.init()
 
@@ -43,16 +47,17 @@ class TTSApp():
         self.tts.setProperty('voice', voices[voice_idx].id)
 
         while True:
-            while len(self.queue)>0:
-                self.log.info("Starting TTS")
-                msg = self.queue.pop(0)
-                self.log.info(f"Saying {msg}")
-                self.tts.say(msg)
-                self.tts.runAndWait()
-                self.log.info("TTS complete")
-                self.last_completion = time.time()
-            
-            time.sleep(0.25)
+            item = self.queue.get()
+            self.log.info("Starting TTS")
+            msg = item['text']
+            self.log.info(f"Saying {msg}")
+            self.speaking_priority = item['priority']
+            TRACER.mark(item.get('trace'), "speech.start")
+            self.tts.say(msg)
+            self.tts.runAndWait()
+            self.speaking_priority = None
+            self.log.info("TTS complete")
+            self.last_completion = time.time()
 
 if __name__ == "__main__":
     tts = TTSApp()
@@ -1,94 +1,208 @@
-from threading import Thread
-import json
+from threading import Thread, current_thread
 import re
-from time import sleep
+import time
 
 import websocket
-import requests
 
 from config import *
 from logs import *
+from tracing import TRACER
+from twitchsender import TwitchSender
 
-''' WebSocket App for communicating with Twitch '''
+''' WebSocket App for communicating with Twitch
+
+    Given on_message, chat messages in the channel are read off the websocket
+    (even when sending through the API) and passed on as message dicts.
+    Without a token it logs in anonymously, which is enough to read.  A
+    read_only app never sends, so it doesn't set up the API sender either.
+
+    If the websocket closes, or Twitch asks us to RECONNECT, running goes
+    back to False and the next start() connects again with a new socket.
+
+    Sends are marked in a message's trace as trace_stage.
+'''
 class TwitchApp():
     app = None
     wsa = None
     thread = None
     running = False
+    token = None
 
-    def __init__(self, name, channel):
+    def __init__(self, name, channel, on_message=None, read_only=False, trace_stage="twitch.sent"):
         self.log = Logger(f"twitch {name}")
         self.name = name
         self.channel = channel
+        self.on_message_cb = on_message
+        self.trace_stage = trace_stage
 
 
         self.send_method = CONFIG.get("twitch.tv", "send_method", fallback="ws")
+        self.max_message_length = CONFIG.getint("twitch.tv", "max_message_length", fallback=500)
+        self.use_api = self.send_method != "ws" and not read_only
+        self.use_ws = (self.send_method == "ws" and not read_only) or on_message is not None
 
-        if self.send_method == "ws":
+        if self.use_ws:
             self.ws_url = CONFIG.get("twitch.tv", "chat_ws_url", fallback=None)
-            self.thread = Thread(daemon=True, target=self.loop)        
-        else:
+
+        if self.use_api:
             self.client_id = CONFIG.get("twitch.tv", "client_id", fallback=None)        
             self.api_url = CONFIG.get("twitch.tv", "chat_api_url", fallback=None)
             self.broadcaster_id = CONFIG.getint("twitch.tv", "broadcaster_id", fallback=None)
             self.user_id = CONFIG.getint("twitch.tv", "user_id", fallback=None)
+            self.sender = TwitchSender(name, self.api_url, self.client_id, self.broadcaster_id, self.user_id,
+                                       clean=self.clean_message, max_length=self.max_message_length,
+                                       trace_stage=trace_stage)
 
+    ## One websocket message can hold several IRC lines
     def on_ws_message(self, ws, message):
-        self.log.info(message)
+        for line in message.split("\r\n"):
+            if not line:
+                continue
+
+            if line.startswith("PING"):
+                self.ws_send(line.replace("PING", "PONG"))
+                continue
+
+            # Twitch is about to drop us, so close and let on_ws_close reconnect
+            if line.split(" ")[1:2] == ["RECONNECT"]:
+                self.log.warning("Twitch asked us to reconnect")
+                self.wsa.close()
+                continue
+
+            chat = self.parse_privmsg(line)
+            if chat:
+                self.log.debug(f"<{chat['author']}> {chat['text']}")
+                if self.on_message_cb:
+                    self.on_message_cb(chat)
+            else:
+                self.log.info(line)
+
+    ## Turn "@tags :nick!user@host PRIVMSG #channel :text" into a message
+    ## dict, or None for anything else
+    def parse_privmsg(self, line):
+        tags = {}
+
+        if line.startswith("@"):
+            raw_tags, _, line = line[1:].partition(" ")
+            for tag in raw_tags.split(";"):
+                key, _, value = tag.partition("=")
+                tags[key] = self.unescape_tag(value)
 
-        if message.startswith("PING"):
-            self.ws_send(message.replace("PING", "PONG"))        
+        prefix, _, rest = line.partition(" ")
+        command, _, rest = rest.partition(" ")
+
+        if command != "PRIVMSG" or not prefix.startswith(":"):
+            return None
+
+        _, _, text = rest.partition(" :")
+        nick = prefix[1:].split("!")[0]
+        sent = tags.get("tmi-sent-ts")
+
+        return {
+            "author": tags.get("display-name") or nick,
+            "text": text,
+            "sent": int(sent) / 1000 if sent and sent.isdigit() else time.time(),
+            "id": tags.get("id"),
+            "platform": "twitch"
+        }
+
+    def unescape_tag(self, value):
+        escapes = { ":": ";", "s": " ", "\\": "\\", "r": "\r", "n": "\n" }
+        return re.sub(r"\\(.?)", lambda m: escapes.get(m.group(1), m.group(1)), value)
 
     def on_ws_open(self, ws):
         self.ws_send(f"CAP REQ :twitch.tv/membership twitch.tv/tags twitch.tv/commands")
-        self.ws_send(f"PASS oauth:{self.token}")
+
+        # Anonymous logins only need a justinfan nick
+        if self.token:
+            self.ws_send(f"PASS oauth:{self.token}")
+
         self.ws_send(f"NICK {self.name}")
         self.ws_send(f"JOIN #{self.channel}")
 
+    ## Runs on the websocket's own thread, so it can't join it.  Clearing
+    ## running lets ensure_connected start a fresh connection.
     def on_ws_close(self, ws):
         self.log.error("***** WEBSOCKET TO TWITCH CLOSED *****")
         self.log.error("***** WEBSOCKET TO TWITCH CLOSED *****")
         self.log.error("***** WEBSOCKET TO TWITCH CLOSED *****")
-        self.log.error("SHUTTING DOWN")
-        self.shutdown()
+
+        if self.running:
+            self.log.error("Will reconnect")
+            self.running = False
 
     def ws_send(self, message):
         self.log.info(f"Sending '{message}'")
         self.wsa.send(message)
 
-    def api_send(self, message, attempt=1):
-        headers = {
-            "Authorization": f"Bearer {self.token}",
-            "Client-Id": self.client_id
-        }
-        data = {
-            "broadcaster_id": self.broadcaster_id,
-            "sender_id": self.user_id,
-            "message": message
-        }
-
-        self.log.debug(f"Sending via API call to {self.api_url}: {data}")
+    ## API sends are queued and go out from the sender's thread
+    def say(self, message, trace=None):
+        lines = self.pack_lines(re.split("[\r\n]+", message))
 
-        resp = requests.post(self.api_url, headers=headers, json=data)
-        if (resp.status_code == 200):
-            self.log.debug("Message sent successfully")
-        else:
-            self.log.error(f"Got status code: {resp.status_code}")
-            self.log.error(resp.json())
+        for line in lines:
+            if self.send_method == "api":
+                self.sender.send(line, trace)
+            else:
+                self.ws_send(f"PRIVMSG #{self.channel} :{line}")
 
-            if attempt < 3:
-                attempt += 1
-                self.log.warning(f"Resending failed message attempt {attempt}..")
-                self.api_send(self.clean_message(message),attempt)
+        if self.send_method != "api":
+            TRACER.mark(trace, self.trace_stage)
 
-    def say(self, message):
-        lines = re.split("[\r\n]+", message)
+    ## Fit lines into as few messages as possible without going over the
+    ## length limit.  Short lines are joined with spaces and long ones are
+    ## split between words.  Chat commands like /pin always go on their own.
+    def pack_lines(self, lines):
+        packed = []
+        current = ""
 
         for line in lines:
-            if self.send_method == "api":
-                self.api_send(line)
+            line = line.strip()
+            if not line:
+                continue
+
+            if line.startswith("/"):
+                if current:
+                    packed.append(current)
+                    current = ""
+                packed.append(line)
+                continue
+
+            for part in self.split_line(line):
+                if current and len(current) + 1 + len(part) <= self.max_message_length:
+                    current = f"{current} {part}"
+                else:
+                    if current:
+                        packed.append(current)
+                    current = part
+
+        if current:
+            packed.append(current)
+
+        return packed
+
+    def split_line(self, line):
+        parts = []
+        current = ""
+
+        for word in line.split():
+            # A single word longer than a message has to be cut
+            while len(word) > self.max_message_length:
+                if current:
+                    parts.append(current)
+                    current = ""
+                parts.append(word[:self.max_message_length])
+                word = word[self.max_message_length:]
+
+            if current and len(current) + 1 + len(word) > self.max_message_length:
+                parts.append(current)
+                current = word
             else:
-                self.ws_send(f"PRIVMSG #{self.channel} :{line}")
+                current = f"{current} {word}" if current else word
+
+        if current:
+            parts.append(current)
+
+        return parts
 
     def clean_message(self, message):
         return re.sub("[^\w\.\!\?\:\, ]","",message)
@@ -101,25 +215,28 @@ class TwitchApp():
         except Exception as ex:
             self.log.error("Exception in Twitch", exc_info=ex)
 
-    def start(self, token):
+    def start(self, token=None):
         self.token = token
         self.running = True
 
-        ## If we're using the websockets irc method to send then we need to 
-        ## connect and run in a thread
-        if self.send_method == "ws":
+        ## If we're using the websockets irc method to send or read then we
+        ## need to connect and run in a thread
+        if self.use_ws:
             self.log.info(f"Starting WS thread") 
             websocket.enableTrace = True        
             self.wsa = websocket.WebSocketApp(
                 self.ws_url, 
                 on_message=lambda ws, message: self.on_ws_message(ws, message),
                 on_open=lambda ws: self.on_ws_open(ws),
-                on_close=lambda ws: self.on_ws_close(ws)
+                on_close=lambda ws, *args: self.on_ws_close(ws)
             )
         
+            self.thread = Thread(daemon=True, target=self.loop)
             self.thread.start()
-        else:
-            self.log.info("Using API sends, no thread needed.")
+
+        if self.use_api and not self.sender.running:
+            self.log.info("Using API sends, starting sender thread.")
+            self.sender.start(token)
 
     def shutdown(self):
         if not self.running:
@@ -129,7 +246,11 @@ class TwitchApp():
         self.running = False
         self.log.info(f"Shutting down..")
 
-        if self.send_method == "ws":
+        if self.use_ws:
             self.wsa.close()
-            self.thread.join()
+            if self.thread is not current_thread():
+                self.thread.join()
+
+        if self.use_api:
+            self.sender.shutdown()
 
@@ -0,0 +1,167 @@
+import time
+from collections import deque
+from random import uniform
+from threading import Thread, Condition
+
+import requests
+
+from config import *
+from logs import *
+from tracing import TRACER
+
+''' Allows `rate` sends every `period` seconds, in bursts of up to `rate` '''
+class TokenBucket():
+    def __init__(self, rate, period):
+        self.capacity = rate
+        self.tokens = float(rate)
+        self.fill_rate = rate / period
+        self.last = time.monotonic()
+
+    ## Take a token, returning how many seconds to wait first if there isn't
+    ## one yet
+    def take(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.last) * self.fill_rate)
+        self.last = now
+        self.tokens -= 1
+
+        return max(0.0, -self.tokens / self.fill_rate)
+
+''' Sends chat messages through the Twitch API on its own thread.
+
+    Lines are queued so say() never waits on the network, and sent in order
+    over one keep-alive session, no faster than Twitch's per-channel rate
+    limit.  Failed sends are retried with exponential backoff and jitter.
+    If more than max_queue lines back up the oldest are dropped.
+
+    Lines that are waiting when the next send goes out are joined into one
+    message as long as they fit in max_length.  Chat commands (lines
+    starting with /) are never joined.
+'''
+class TwitchSender():
+    def __init__(self, name, api_url, client_id, broadcaster_id, user_id, clean=None, max_length=500,
+                 trace_stage="twitch.sent"):
+        self.log = Logger(f"twitch sender {name}")
+        self.trace_stage = trace_stage
+        self.api_url = api_url
+        self.client_id = client_id
+        self.broadcaster_id = broadcaster_id
+        self.user_id = user_id
+        self.clean = clean
+        self.max_length = max_length
+        self.running = False
+
+        self.bucket = TokenBucket(CONFIG.getint("twitch.tv", "rate_limit", fallback=20),
+                                  CONFIG.getfloat("twitch.tv", "rate_period", fallback=30.0))
+        self.max_queue = CONFIG.getint("twitch.tv", "max_queue", fallback=50)
+        self.max_attempts = CONFIG.getint("twitch.tv", "max_attempts", fallback=3)
+        self.backoff = CONFIG.getfloat("twitch.tv", "backoff", fallback=0.5)
+        self.max_backoff = CONFIG.getfloat("twitch.tv", "max_backoff", fallback=10.0)
+
+        self.queue = deque()
+        self.condition = Condition()
+        self.session = requests.Session()
+        self.thread = Thread(daemon=True, target=self.loop)
+
+    def start(self, token):
+        self.session.headers.update({
+            "Authorization": f"Bearer {token}",
+            "Client-Id": self.client_id
+        })
+        self.running = True
+        self.thread.start()
+
+    def shutdown(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+
+        if self.thread.is_alive():
+            self.thread.join()
+
+        self.session.close()
+
+    def send(self, message, trace=None):
+        with self.condition:
+            if len(self.queue) >= self.max_queue:
+                dropped = self.queue.popleft()
+                self.log.warning(f"Send queue full, dropping '{dropped['message']}'")
+
+            self.queue.append({ "message": message, "traces": [trace] })
+            self.condition.notify()
+
+    def next_item(self):
+        with self.condition:
+            while self.running and not self.queue:
+                self.condition.wait()
+
+            if not self.running:
+                return None
+
+            item = self.queue.popleft()
+
+            while self.queue and self.can_join(item['message'], self.queue[0]['message']):
+                queued = self.queue.popleft()
+                item = {
+                    "message": f"{item['message']} {queued['message']}",
+                    "traces": item['traces'] + queued['traces']
+                }
+
+            return item
+
+    def can_join(self, message, other):
+        return (not message.startswith("/") and not other.startswith("/") and
+                len(message) + 1 + len(other) <= self.max_length)
+
+    def loop(self):
+        while True:
+            item = self.next_item()
+            if item is None:
+                break
+
+            wait = self.bucket.take()
+            if wait > 0:
+                self.log.debug(f"Rate limited, waiting {wait:.2f}s")
+                time.sleep(wait)
+
+            if self.post(item['message']):
+                for trace in item['traces']:
+                    TRACER.mark(trace, self.trace_stage)
+
+        self.log.info("Sender stopped")
+
+    def post(self, message):
+        for attempt in range(1, self.max_attempts + 1):
+            data = {
+                "broadcaster_id": self.broadcaster_id,
+                "sender_id": self.user_id,
+                "message": message
+            }
+
+            self.log.debug(f"Sending via API call to {self.api_url}: {data}")
+
+            try:
+                resp = self.session.post(self.api_url, json=data, timeout=10)
+            except requests.RequestException as e:
+                self.log.error(f"Send failed: {e}")
+                resp = None
+
+            if resp is not None and resp.status_code == 200:
+                self.log.debug("Message sent successfully")
+                return True
+
+            if resp is not None:
+                self.log.error(f"Got status code: {resp.status_code}")
+                self.log.error(resp.text)
+
+                # Anything else in the 400s is probably the message itself
+                if 400 <= resp.status_code < 500 and resp.status_code != 429 and self.clean:
+                    message = self.clean(message)
+
+            if attempt < self.max_attempts:
+                delay = uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+                self.log.warning(f"Resending failed message attempt {attempt + 1} in {delay:.2f}s..")
+                time.sleep(delay)
+
+        self.log.error(f"Giving up on '{message}'")
+        return False
@@ -0,0 +1,93 @@
+import time
+from collections import deque
+from threading import Lock
+
+from config import *
+from logs import *
+
+''' Viseme events lined up against the audio they belong to.
+
+    The speech SDK delivers visemes in bursts, well before the audio they go
+    with is heard.  Each one carries its offset into the audio, so they're
+    buffered here and handed out once the playback clock reaches them.
+
+    The clock starts when the audio does (or the first viseme, if nothing
+    says when that was).  offset shifts every event, positive to move the
+    mouth later, to tune out output latency.
+
+    How late each viseme made it to the screen is kept for tuning.
+'''
+class VisemeTimeline():
+    def __init__(self, offset=0.0, samples=1000):
+        self.log = Logger("visemes")
+        self.offset = offset
+        self.lock = Lock()
+        self.events = deque()
+        self.start_time = None
+        self.errors = deque(maxlen=samples)
+        self.skipped = 0
+
+    ## Forget everything queued and wait for the next utterance to start
+    def reset(self):
+        with self.lock:
+            self.events.clear()
+            self.start_time = None
+
+    def start(self, now=None):
+        with self.lock:
+            if self.start_time is None:
+                self.start_time = now or time.time()
+
+    def add(self, audio_offset, viseme_id):
+        with self.lock:
+            if self.start_time is None:
+                self.start_time = time.time()
+
+            self.events.append((audio_offset + self.offset, viseme_id))
+
+    def position(self, now=None):
+        if self.start_time is None:
+            return None
+
+        return (now or time.time()) - self.start_time
+
+    ## Pop the visemes whose time has come.  If the frame was late and more
+    ## than one is due only the last would ever be seen, so the rest just
+    ## count as skipped.
+    def due(self, now=None):
+        with self.lock:
+            position = self.position(now)
+            if position is None or not self.events or self.events[0][0] > position:
+                return None
+
+            when, viseme_id = self.events.popleft()
+            while self.events and self.events[0][0] <= position:
+                self.skipped += 1
+                when, viseme_id = self.events.popleft()
+
+            self.errors.append(position - when)
+            return viseme_id
+
+    ## Seconds until the next viseme is due, or None if there's nothing queued
+    def next_due(self, now=None):
+        with self.lock:
+            position = self.position(now)
+            if position is None or not self.events:
+                return None
+
+            return max(0.0, self.events[0][0] - position)
+
+    def stats(self):
+        with self.lock:
+            errors = sorted(self.errors)
+
+        if not errors:
+            return { "count": 0, "skipped": self.skipped }
+
+        return {
+            "count": len(errors),
+            "skipped": self.skipped,
+            "mean_ms": round(sum(errors) / len(errors) * 1000, 2),
+            "p95_ms": round(errors[int(len(errors) * 0.95)] * 1000, 2),
+            "max_ms": round(errors[-1] * 1000, 2)
+        }
@@ -10,6 +10,8 @@ from websockets.sync.server import serve as wbs_serve
 
 from config import *
 from logs import *
+from assetstore import ASSETS
+from tracing import TRACER
 
 class WebserverApp:
     def __init__(self, on_copilot_message=None):
@@ -119,6 +121,10 @@ class WebserverApp:
             return None
         elif path == "/message":
             return self.last_message
+        elif path == "/assets":
+            return ASSETS.memory_usage(detail=True)
+        elif path == "/latency":
+            return TRACER.stats()
         elif path == "/":
             return self.handle_get_path("/index.html")
         elif self.path_is_valid_and_exists(path):
@@ -135,8 +141,18 @@ class WebserverApp:
     def handle_get_path(self, path):
         mimetype, _ = mimetypes.guess_type(path)
         mode = "r" if mimetype and mimetype.startswith("text/") else "rb"
+        abspath = self.get_absolute_path(path)
+
+        # Images come from the shared asset store, keyed on mtime so edits
+        # still show up
+        if mimetype and mimetype.startswith("image/"):
+            mtime = os.stat(abspath).st_mtime_ns
+            return ASSETS.get(f"file:{abspath}:{mtime}", lambda: self.read_file(abspath, mode))
+
+        return self.read_file(abspath, mode)
 
-        with open(self.get_absolute_path(path), mode) as file:
+    def read_file(self, abspath, mode):
+        with open(abspath, mode) as file:
             return file.read()
 
     def handle_websocket_connect(self, websocket):